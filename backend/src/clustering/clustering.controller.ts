@@ -17,7 +17,7 @@ export class ClusteringController {
   @ApiOperation({
     summary: 'Retrieve clustering results',
     description:
-      'Returns the latest clustering results. If analysis_profile is provided, returns the latest clustering for that profile.',
+      'Returns the latest clustering results for each profile. If analysis_profile is provided, returns the latest clustering for that profile.',
   })
   @ApiQuery({
     name: 'analysis_profile',
@@ -26,6 +26,12 @@ export class Clustering extends Document {
     Partition: string;
   }[];
 
+  @Prop()
+  results_hash?: string;
+
+  @Prop()
+  version?: number;
+
   @Prop({ default: Date.now })
   createdAt: Date;
 }
@@ -10,8 +10,25 @@ export class ClusteringService {
     private readonly model: Model<Clustering>,
   ) {}
 
+  // Older snapshots are kept for history; only the latest per profile is
+  // returned. Each profile is looked up on its own so the
+  // (analysis_profile, createdAt) index serves the query, instead of sorting
+  // every snapshot in memory.
   async findAll(): Promise<Clustering[]> {
-    return this.model.find().sort({ createdAt: -1 }).exec();
+    const profiles: string[] = await this.model
+      .distinct('analysis_profile')
+      .exec();
+
+    const latest = await Promise.all(
+      profiles.map((profile) => this.findLatestByProfile(profile)),
+    );
+
+    return latest
+      .filter((clustering): clustering is Clustering => clustering !== null)
+      .sort(
+        (a, b) =>
+          new Date(b.createdAt).getTime() - new Date(a.createdAt).getTime(),
+      );
   }
 
   async findLatestByProfile(
@@ -1,6 +1,11 @@
 import { Module } from '@nestjs/common';
 import { MongooseModule } from '@nestjs/mongoose';
-import { Distance, DistanceSchema } from './distance.schema';
+import {
+  Distance,
+  DistanceSchema,
+  DistanceChunk,
+  DistanceChunkSchema,
+} from './distance.schema';
 import { DistanceService } from './distance.service';
 import { DistanceController } from './distance.controller';
 
@@ -8,6 +13,7 @@ import { DistanceController } from './distance.controller';
   imports: [
     MongooseModule.forFeature([
       { name: Distance.name, schema: DistanceSchema },
+      { name: DistanceChunk.name, schema: DistanceChunkSchema },
     ]),
   ],
   controllers: [DistanceController],
@@ -1,5 +1,5 @@
 import { Prop, Schema, SchemaFactory } from '@nestjs/mongoose';
-import { Document } from 'mongoose';
+import { Document, Types } from 'mongoose';
 
 @Schema({ collection: 'distance' })
 export class Distance extends Document {
@@ -9,14 +9,54 @@ export class Distance extends Document {
   @Prop({ type: [String], required: true })
   samples: string[];
 
-  @Prop({ type: [[Number]], required: true })
-  matrix: number[][];
+  // Only set on documents stored before chunked storage; the pipeline now
+  // stores the matrix in DistanceChunk documents.
+  @Prop({ type: [[Number]] })
+  matrix?: number[][];
 
   @Prop({ type: String, required: true })
   newick: string;
 
+  @Prop()
+  format?: string;
+
+  @Prop({ type: Types.ObjectId })
+  version?: Types.ObjectId;
+
+  @Prop()
+  chunks?: number;
+
   @Prop({ default: Date.now })
   createdAt: Date;
 }
 
 export const DistanceSchema = SchemaFactory.createForClass(Distance);
+
+// Condensed upper triangle of the distance matrix for rows
+// [row_start, row_end), packed as little-endian uint16 values.
+@Schema({ collection: 'distance_chunks' })
+export class DistanceChunk extends Document {
+  @Prop({ required: true })
+  analysis_profile: string;
+
+  @Prop({ type: Types.ObjectId, required: true })
+  version: Types.ObjectId;
+
+  @Prop({ required: true })
+  chunk: number;
+
+  @Prop({ required: true })
+  row_start: number;
+
+  @Prop({ required: true })
+  row_end: number;
+
+  @Prop({ type: Buffer, required: true })
+  data: Buffer;
+}
+
+export const DistanceChunkSchema = SchemaFactory.createForClass(DistanceChunk);
+DistanceChunkSchema.index(
+  { analysis_profile: 1, version: 1, chunk: 1 },
+  { unique: true },
+);
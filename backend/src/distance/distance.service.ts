@@ -1,7 +1,7 @@
 import { Injectable } from '@nestjs/common';
 import { InjectModel } from '@nestjs/mongoose';
 import { Model } from 'mongoose';
-import { Distance } from './distance.schema';
+import { Distance, DistanceChunk } from './distance.schema';
 import { DistanceDto } from './dto/distance.dto';
 
 @Injectable()
@@ -9,6 +9,8 @@ export class DistanceService {
   constructor(
     @InjectModel(Distance.name)
     private distanceModel: Model<Distance>,
+    @InjectModel(DistanceChunk.name)
+    private distanceChunkModel: Model<DistanceChunk>,
   ) {}
 
   async store(analysis_profile: string, dto: DistanceDto) {
@@ -20,6 +22,49 @@ export class DistanceService {
   }
 
   async get(analysis_profile: string) {
-    return this.distanceModel.findOne({ analysis_profile }).lean();
+    const distance = await this.distanceModel
+      .findOne({ analysis_profile })
+      .lean();
+
+    if (!distance || distance.matrix?.length || !distance.version) {
+      return distance;
+    }
+
+    return { ...distance, matrix: await this.readMatrix(distance) };
+  }
+
+  // Rebuild the full symmetric matrix from the condensed upper-triangle chunks.
+  private async readMatrix(
+    distance: Pick<Distance, 'analysis_profile' | 'samples' | 'version'>,
+  ): Promise<number[][]> {
+    const n = distance.samples.length;
+    const matrix = Array.from({ length: n }, () =>
+      new Array<number>(n).fill(0),
+    );
+
+    const chunks = await this.distanceChunkModel
+      .find({
+        analysis_profile: distance.analysis_profile,
+        version: distance.version,
+      })
+      .sort({ chunk: 1 })
+      .lean();
+
+    for (const chunk of chunks) {
+      const data: any = chunk.data;
+      const bytes = Buffer.isBuffer(data) ? data : Buffer.from(data.buffer);
+      let offset = 0;
+
+      for (let i = chunk.row_start; i < chunk.row_end; i++) {
+        for (let j = i + 1; j < n; j++) {
+          const value = bytes.readUInt16LE(offset);
+          matrix[i][j] = value;
+          matrix[j][i] = value;
+          offset += 2;
+        }
+      }
+    }
+
+    return matrix;
   }
 }
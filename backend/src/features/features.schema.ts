@@ -25,6 +25,8 @@ export class Feature extends Document {
     type: string;
     coordinates: number[];
   };
+
+  @Prop() properties_hash?: string;
 }
 
 export const FeatureSchema = SchemaFactory.createForClass(Feature);
@@ -63,7 +63,9 @@ export class FeaturesService {
     const updated = await this.featureModel
       .findOneAndUpdate(
         { 'properties.ID': sampleId },
-        { $set: updatePayload },
+        // Properties edited here no longer match the hash stored by the
+        // pipeline, so the next upload compares them field by field.
+        { $set: updatePayload, $unset: { properties_hash: '' } },
         { new: true },
       )
       .exec();
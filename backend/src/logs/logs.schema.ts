@@ -16,7 +16,7 @@ class UpdateEntry {
 
 @Schema()
 export class Log extends Document {
-  @Prop({ required: true, index: true })
+  @Prop({ required: true, unique: true })
   sample_id: string;
 
   @Prop({ required: true })
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import os
-import json
 from dotenv import load_dotenv, find_dotenv
 
 from process_samples import process_samples_by_profile
@@ -16,8 +15,8 @@ from upload import (
     upload_clustering,
     upload_distance,
 )
-from mimosa_runner import run_stage
-from mimosa_state import Status
+from artefacts import write_clustering_jsonl, write_distance
+from mimosa_runner import run_stage, skip_stages
 
 dotenv_path = find_dotenv(filename=".env", usecwd=True)
 if not dotenv_path:
@@ -29,30 +28,39 @@ def mimosa(
     profile,
     profile_dir,
     args,
-    credentials,
-    token,
+    bonsai_client,
+    catalogue,
     sample_ids,
-    upload_token,
+    uploader,
     state,
+    detail_cache=None,
+    reportree_options=None,
+    allele_profiles=None,
 ):
     os.makedirs(profile_dir, exist_ok=True)
     sample_count = len(sample_ids)
 
+    # ReporTree clusters the complete profile, so sample details are only
+    # restricted to the target samples when updating existing metadata.
     metadata_files, cgmlst_files = run_stage(
         state,
         profile,
         "prepare_metadata",
         process_samples_by_profile,
-        bonsai_api_url=credentials["bonsai_api_url"],
-        token=token,
+        client=bonsai_client,
+        catalogue=catalogue,
         output_folder=profile_dir,
         target_profiles=[profile],
         user_selected_profiles=args.profile,
+        sample_ids=sample_ids if args.update else None,
+        fetch_workers=args.fetch_workers,
+        cache=detail_cache,
+        allele_profiles=allele_profiles,
         count=sample_count,
     )
 
     if not metadata_files or not cgmlst_files:
-        state[profile]["prepare_metadata"]["status"] = Status.SKIPPED
+        skip_stages(state, profile, "prepare_metadata")
         return
 
     metadata_entry = metadata_files[0]
@@ -75,11 +83,11 @@ def mimosa(
 
     features_json_path = os.path.join(
         profile_dir,
-        f"features_{profile}.json",
+        f"features_{profile}.jsonl",
     )
 
     if args.update:
-        run_stage(
+        features = run_stage(
             state,
             profile,
             "process_features",
@@ -87,7 +95,7 @@ def mimosa(
             full_metadata_file,
             full_metadata_file,
             features_json_path,
-            save_files=True,
+            save_files=args.save_files,
             count=sample_count,
         )
 
@@ -96,16 +104,16 @@ def mimosa(
             profile,
             "upload_features",
             upload_features,
-            features_json_path,
+            data=features,
             overwrite=True,
             show_log=True,
-            upload_token=upload_token,
+            uploader=uploader,
             count=sample_count,
         )
 
-        state[profile]["run_reportree"]["status"] = Status.SKIPPED
-        state[profile]["upload_clustering"]["status"] = Status.SKIPPED
-        state[profile]["upload_distance"]["status"] = Status.SKIPPED
+        skip_stages(
+            state, profile, "run_reportree", "upload_clustering", "upload_distance"
+        )
         return
 
     run_stage(
@@ -119,6 +127,7 @@ def mimosa(
         profile,
         save_files=True,
         count=sample_count,
+        **(reportree_options or {}),
     )
 
     cluster_composition_tsv = os.path.join(
@@ -128,7 +137,7 @@ def mimosa(
 
     clusters_json_path = os.path.join(
         profile_dir,
-        f"clusters_{profile}.json",
+        f"clusters_{profile}.jsonl",
     )
 
     dist_tsv = os.path.join(
@@ -146,7 +155,7 @@ def mimosa(
         f"{profile}_distance.json",
     )
 
-    run_stage(
+    features = run_stage(
         state,
         profile,
         "process_features",
@@ -154,7 +163,7 @@ def mimosa(
         metadata_partitions_tsv,
         full_metadata_file,
         features_json_path,
-        save_files=True,
+        save_files=args.save_files,
         count=sample_count,
     )
 
@@ -164,18 +173,18 @@ def mimosa(
     )
     clustering_result["analysis_profile"] = profile
 
-    with open(clusters_json_path, "w", encoding="utf-8") as f:
-        json.dump(clustering_result, f, indent=2)
+    if args.save_files:
+        write_clustering_jsonl(clusters_json_path, clustering_result)
 
     run_stage(
         state,
         profile,
         "upload_features",
         upload_features,
-        features_json_path,
+        data=features,
         overwrite=args.update,
         show_log=args.update or not sample_ids,
-        upload_token=upload_token,
+        uploader=uploader,
         count=sample_count,
     )
 
@@ -184,13 +193,14 @@ def mimosa(
         profile,
         "upload_clustering",
         upload_clustering,
-        clusters_json_path,
-        upload_token=upload_token,
+        data=clustering_result,
+        uploader=uploader,
+        retention=args.clustering_retention,
         count=sample_count,
     )
 
     if os.path.exists(dist_tsv) and os.path.exists(nwk_path):
-        samples, matrix = parse_distance_tsv(dist_tsv)
+        samples, matrix = parse_distance_tsv(dist_tsv, cache=args.save_files)
         newick_text = read_newick(nwk_path)
 
         distance_doc = {
@@ -200,18 +210,18 @@ def mimosa(
             "newick": newick_text,
         }
 
-        with open(distance_json_path, "w", encoding="utf-8") as f:
-            json.dump(distance_doc, f, indent=2)
+        if args.save_files:
+            write_distance(distance_json_path, distance_doc)
 
         run_stage(
             state,
             profile,
             "upload_distance",
             upload_distance,
-            distance_json_path,
-            upload_token=upload_token,
+            data=distance_doc,
+            uploader=uploader,
             count=sample_count,
         )
     else:
         print("Distance matrix or Newick file missing — skipping distance upload.")
-        state[profile]["upload_distance"]["status"] = Status.SKIPPED
+        skip_stages(state, profile, "upload_distance")
@@ -1,7 +1,11 @@
 import json
 import os
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv, find_dotenv
 
 dotenv_path = find_dotenv(filename=".env", usecwd=True)
@@ -9,6 +13,13 @@ if not dotenv_path:
     raise FileNotFoundError("Could not find project-root .env file.")
 load_dotenv(dotenv_path)
 
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_POOL_SIZE = 10
+DEFAULT_PAGE_SIZE = 500
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
 
 def normalise_scalar(value, default="Unknown"):
     """
@@ -27,6 +38,82 @@ def auth_headers(token):
     }
 
 
+class BonsaiClient:
+    """
+    HTTP client for the Bonsai API, intended to be created once per run.
+
+    Owns a pooled requests.Session so connections are kept alive across calls,
+    applies a default timeout to every request and retries connection errors and
+    5xx responses with exponential backoff. Only idempotent methods are retried,
+    so a POST (job submission, token requests) is never sent twice.
+    """
+
+    def __init__(
+        self,
+        bonsai_api_url,
+        token=None,
+        timeout=DEFAULT_TIMEOUT,
+        retries=DEFAULT_RETRIES,
+        backoff_factor=DEFAULT_BACKOFF_FACTOR,
+        pool_size=DEFAULT_POOL_SIZE,
+    ):
+        self.bonsai_api_url = bonsai_api_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+        )
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, path, headers=None, timeout=None, **kwargs):
+        """Send a request to the Bonsai API and raise on HTTP errors."""
+        request_headers = (
+            auth_headers(self.token) if self.token else {"Accept": "application/json"}
+        )
+        if headers:
+            request_headers.update(headers)
+
+        response = self.session.request(
+            method,
+            f"{self.bonsai_api_url}{path}",
+            headers=request_headers,
+            timeout=timeout or self.timeout,
+            **kwargs,
+        )
+        response.raise_for_status()
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
 def load_credentials(credentials_file):
     """
     Load Bonsai and MIMOSA credentials from a user-specific JSON file.
@@ -52,11 +139,18 @@ def load_credentials(credentials_file):
     }
 
 
-def get_access_token(credentials):
-    """Retrieve access token from the Bonsai API."""
+def get_access_token(credentials, client=None):
+    """
+    Retrieve access token from the Bonsai API.
+    If a BonsaiClient is given, the token is also stored on it.
+    """
+    owns_client = client is None
+    if owns_client:
+        client = BonsaiClient(credentials["bonsai_api_url"])
+
     try:
-        response = requests.post(
-            f"{credentials['bonsai_api_url']}/token",
+        response = client.post(
+            "/token",
             headers={
                 "Accept": "application/json",
                 "Content-Type": "application/x-www-form-urlencoded",
@@ -67,8 +161,9 @@ def get_access_token(credentials):
                 "password": credentials["bonsai_password"],
             },
         )
-        response.raise_for_status()
-        return response.json().get("access_token")
+        token = response.json().get("access_token")
+        client.token = token
+        return token
 
     except ConnectionError:
         raise RuntimeError(
@@ -79,6 +174,10 @@ def get_access_token(credentials):
     except requests.HTTPError as e:
         raise RuntimeError(f"Failed to get access token: {e.response.text}") from e
 
+    finally:
+        if owns_client:
+            client.close()
+
 
 def authenticate_mimosa_user(credentials):
     """Authenticate the uploader as a MIMOSA user."""
@@ -114,42 +213,63 @@ def authenticate_mimosa_user(credentials):
         ) from e
 
 
-def fetch_samples(bonsai_api_url, token):
-    """Fetch all samples from the Bonsai API and normalise profile fields."""
+def iter_samples(client, page_size=DEFAULT_PAGE_SIZE, workers=1):
+    """
+    Yield all samples from the Bonsai API page by page and normalise profile fields.
+    The first page reports records_total, which determines the remaining pages.
+    With workers > 1, up to that many pages are requested concurrently while
+    samples are still yielded in catalogue order.
+    """
+
+    def fetch_page(skip):
+        response = client.get("/samples/", params={"limit": page_size, "skip": skip})
+        return response.json()
 
-    count_response = requests.get(
-        f"{bonsai_api_url}/samples/?limit=1",
-        headers=auth_headers(token),
-    )
-    count_response.raise_for_status()
+    def normalised(page):
+        for sample in page.get("data", []):
+            sample["profile"] = normalise_scalar(sample.get("profile"))
+            yield sample
 
-    payload = count_response.json()
-    total = payload.get("records_total", 0)
+    first_page = fetch_page(0)
+    total = first_page.get("records_total", 0)
 
-    if total == 0:
-        return []
+    yield from normalised(first_page)
 
-    response = requests.get(
-        f"{bonsai_api_url}/samples/?limit={total}",
-        headers=auth_headers(token),
-    )
-    response.raise_for_status()
+    offsets = range(page_size, total, page_size)
 
-    samples = response.json().get("data", [])
+    if workers <= 1:
+        for skip in offsets:
+            page = fetch_page(skip)
+            if not page.get("data"):
+                break
+            yield from normalised(page)
+        return
 
-    for sample in samples:
-        sample["profile"] = normalise_scalar(sample.get("profile"))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        offsets = iter(offsets)
 
-    return samples
+        for skip in offsets:
+            pending.append(executor.submit(fetch_page, skip))
+            if len(pending) >= workers:
+                break
+
+        while pending:
+            page = pending.popleft().result()
+            next_skip = next(offsets, None)
+            if next_skip is not None:
+                pending.append(executor.submit(fetch_page, next_skip))
+            yield from normalised(page)
+
+
+def fetch_samples(client, page_size=DEFAULT_PAGE_SIZE, workers=1):
+    """Fetch all samples from the Bonsai API and normalise profile fields."""
+    return list(iter_samples(client, page_size=page_size, workers=workers))
 
 
-def fetch_sample_details(bonsai_api_url, token, sample_id):
+def fetch_sample_details(client, sample_id):
     """Fetch details of a specific sample by ID from the Bonsai API."""
-    response = requests.get(
-        f"{bonsai_api_url}/samples/{sample_id}",
-        headers=auth_headers(token),
-    )
-    response.raise_for_status()
+    response = client.get(f"/samples/{sample_id}")
 
     data = response.json()
 
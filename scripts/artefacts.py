@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import os
+import json
+import numpy as np
+
+JSONL_SUFFIX = ".jsonl"
+
+
+def write_jsonl(path, documents):
+    """Write documents to a JSON Lines file, one compact document per line."""
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for document in documents:
+            f.write(json.dumps(document, ensure_ascii=False, separators=(",", ":")))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def _iter_lines(file):
+    with file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_jsonl(path):
+    """
+    Iterate over the documents of a JSON Lines file, one line at a time.
+    The file is opened immediately, so a missing file fails here rather than
+    on the first iteration.
+    """
+    return _iter_lines(open(path, "r", encoding="utf-8"))
+
+
+def iter_documents(path):
+    """
+    Iterate over the documents of an artefact file. JSON Lines files are read
+    as a stream; other files are read as a JSON array (or a single document).
+    """
+    if path.endswith(JSONL_SUFFIX):
+        return iter_jsonl(path)
+
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    return iter(data if isinstance(data, list) else [data])
+
+
+def write_clustering_jsonl(path, clustering):
+    """
+    Write a clustering result as JSON Lines: a header line with every field
+    except the results, followed by one line per cluster assignment.
+    """
+    header = {k: v for k, v in clustering.items() if k != "results"}
+    return write_jsonl(path, [header, *clustering.get("results", [])]) - 1
+
+
+def read_clustering(path):
+    """Read a clustering result written as JSON Lines or as a JSON document."""
+    if not path.endswith(JSONL_SUFFIX):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    documents = iter_jsonl(path)
+    clustering = next(documents, {})
+    clustering["results"] = list(documents)
+    return clustering
+
+
+def write_distance(path, distance):
+    """
+    Write a distance document as JSON with the matrix stored alongside it as a
+    binary .npy file, referenced by the `matrix_file` field. A matrix that is
+    already memory-mapped from a .npy file in the same directory (as cached by
+    parse_distance_tsv) is referenced instead of being written again.
+    """
+    matrix = distance["matrix"]
+    directory = os.path.dirname(os.path.abspath(path))
+
+    matrix_path = getattr(matrix, "filename", None)
+    if not matrix_path or os.path.dirname(matrix_path) != directory:
+        matrix_path = os.path.splitext(path)[0] + ".npy"
+        np.save(matrix_path, np.asarray(matrix))
+
+    header = {k: v for k, v in distance.items() if k != "matrix"}
+    header["matrix_file"] = os.path.basename(matrix_path)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=2)
+
+
+def read_distance(path):
+    """
+    Read a distance document written by write_distance (the matrix is
+    memory-mapped) or a legacy JSON document with an inline matrix.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        distance = json.load(f)
+
+    matrix_file = distance.pop("matrix_file", None)
+    if matrix_file:
+        matrix_path = os.path.join(os.path.dirname(path), matrix_file)
+        distance["matrix"] = np.load(matrix_path, mmap_mode="r")
+
+    return distance
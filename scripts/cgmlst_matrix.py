@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import numpy as np
+
+MISSING_ALLELE_CODES = {
+    "ASM",
+    "EXC",
+    "INF",
+    "LNF",
+    "PLNF",
+    "PLOT3",
+    "PLOT5",
+    "LOTSC",
+    "NIPH",
+    "NIPHEM",
+    "PAMA",
+    "ALM",
+}
+
+ALLELE_DTYPE = np.uint32
+
+
+def allele_code(value):
+    """
+    Convert an allele call to an integer code.
+    Missing-data codes and calls that are not allele numbers map to 0, which
+    ReporTree treats as missing. Inferred alleles (INF-<n>) keep their number.
+    """
+    if value is None or isinstance(value, bool):
+        return 0
+
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+
+    if isinstance(value, (int, np.integer)):
+        return int(value) if 0 < value <= np.iinfo(ALLELE_DTYPE).max else 0
+
+    value = str(value).strip()
+    if value in MISSING_ALLELE_CODES:
+        return 0
+    if value.startswith("INF-"):
+        value = value[4:]
+
+    if not value.isdigit():
+        return 0
+
+    code = int(value)
+    return code if code <= np.iinfo(ALLELE_DTYPE).max else 0
+
+
+class CgmlstMatrix:
+    """
+    Sample x locus matrix of integer allele codes.
+
+    The locus index is fixed by the first sample added (or by the loci passed in)
+    and only grows if a later sample reports loci that are not yet known. Rows are
+    stored in a preallocated uint32 array that doubles in size when full.
+    """
+
+    def __init__(self, loci=None, capacity=256):
+        self.loci = []
+        self.locus_index = {}
+        self.samples = []
+        self._data = np.zeros((max(capacity, 1), 0), dtype=ALLELE_DTYPE)
+
+        if loci:
+            self._add_loci(loci)
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def values(self):
+        """Allele codes as an (n_samples, n_loci) array view."""
+        return self._data[: len(self.samples)]
+
+    def _add_loci(self, loci):
+        new_loci = [locus for locus in loci if locus not in self.locus_index]
+        if not new_loci:
+            return
+
+        for locus in new_loci:
+            self.locus_index[locus] = len(self.loci)
+            self.loci.append(locus)
+
+        self._data = np.pad(self._data, ((0, 0), (0, len(new_loci))))
+
+    def add(self, sample_id, alleles):
+        """Append a sample from a {locus: allele} mapping."""
+        if any(locus not in self.locus_index for locus in alleles):
+            self._add_loci(alleles)
+
+        row_index = len(self.samples)
+        if row_index == self._data.shape[0]:
+            self._data = np.concatenate([self._data, np.zeros_like(self._data)])
+
+        row = self._data[row_index]
+        for locus, value in alleles.items():
+            row[self.locus_index[locus]] = allele_code(value)
+
+        self.samples.append(sample_id)
+
+    def write_tsv(self, path):
+        """Write the matrix as a ReporTree allele TSV, one row at a time."""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\t".join(["sample", *self.loci]) + "\n")
+            for sample_id, row in zip(self.samples, self.values):
+                f.write(sample_id + "\t" + "\t".join(map(str, row.tolist())) + "\n")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+import json
+import hashlib
+import datetime
+from pymongo import DESCENDING, UpdateOne
+
+ASSIGNMENT_COLLECTION = "cluster_assignments"
+ASSIGNMENT_BATCH_SIZE = 1000
+DEFAULT_CLUSTERING_RETENTION = 10
+
+
+def clustering_hash(results):
+    """Stable hash of cluster assignments, independent of their order."""
+    canonical = sorted(
+        (str(r.get("ID")), str(r.get("Partition")), str(r.get("Cluster_ID")))
+        for r in results
+    )
+    return hashlib.sha256(
+        json.dumps(canonical, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+def latest_snapshot(db, profile):
+    """Return the most recent clustering snapshot of a profile, or None."""
+    return db["clustering"].find_one(
+        {"analysis_profile": profile},
+        sort=[("createdAt", DESCENDING), ("_id", DESCENDING)],
+    )
+
+
+def sync_assignments(db, profile, results, version, changed_at):
+    """
+    Bring the per-sample assignments of a profile in line with results.
+
+    Each (sample, partition) has one document holding its current cluster and
+    a history of deltas. Only assignments that changed are written; samples no
+    longer clustered get a null cluster. Returns the number of changed samples.
+    """
+    collection = db[ASSIGNMENT_COLLECTION]
+
+    current = {
+        (doc["ID"], doc["Partition"]): doc.get("Cluster_ID")
+        for doc in collection.find(
+            {"analysis_profile": profile, "Cluster_ID": {"$ne": None}},
+            {"ID": 1, "Partition": 1, "Cluster_ID": 1},
+        )
+    }
+
+    new = {(r["ID"], r["Partition"]): r["Cluster_ID"] for r in results}
+    changes = {
+        key: cluster for key, cluster in new.items() if current.get(key) != cluster
+    }
+    changes.update({key: None for key in current if key not in new})
+
+    operations = []
+    for (sample_id, partition), cluster_id in changes.items():
+        delta = {
+            "version": version,
+            "old": current.get((sample_id, partition)),
+            "new": cluster_id,
+            "changedAt": changed_at,
+        }
+        operations.append(
+            UpdateOne(
+                {"analysis_profile": profile, "ID": sample_id, "Partition": partition},
+                {
+                    "$set": {
+                        "Cluster_ID": cluster_id,
+                        "version": version,
+                        "updatedAt": changed_at,
+                    },
+                    "$push": {"history": delta},
+                },
+                upsert=True,
+            )
+        )
+
+    for start in range(0, len(operations), ASSIGNMENT_BATCH_SIZE):
+        collection.bulk_write(
+            operations[start : start + ASSIGNMENT_BATCH_SIZE], ordered=False
+        )
+
+    return len(changes)
+
+
+def trim_snapshots(db, profile, retention):
+    """Delete all but the latest `retention` snapshots of a profile."""
+    if not retention or retention < 1:
+        return 0
+
+    stale_ids = [
+        doc["_id"]
+        for doc in db["clustering"]
+        .find({"analysis_profile": profile}, {"_id": 1})
+        .sort([("createdAt", DESCENDING), ("_id", DESCENDING)])
+        .skip(retention)
+    ]
+    if not stale_ids:
+        return 0
+
+    return db["clustering"].delete_many({"_id": {"$in": stale_ids}}).deleted_count
+
+
+def store_clustering(db, clustering, retention=DEFAULT_CLUSTERING_RETENTION):
+    """
+    Store a clustering result as a new version of its profile's snapshots.
+
+    A snapshot is only written when the assignments differ from the latest
+    stored snapshot (compared by hash). Per-sample assignments are synced
+    either way, and snapshots beyond the retention count are trimmed.
+    Returns a summary dict.
+    """
+    profile = clustering.get("analysis_profile")
+    results = clustering.get("results") or []
+    results_hash = clustering_hash(results)
+
+    latest = latest_snapshot(db, profile)
+    latest_hash = None
+    if latest:
+        latest_hash = latest.get("results_hash") or clustering_hash(
+            latest.get("results") or []
+        )
+
+    created = latest_hash != results_hash
+    version = (latest or {}).get("version") or 0
+
+    if created:
+        version += 1
+        db["clustering"].insert_one(
+            {**clustering, "results_hash": results_hash, "version": version}
+        )
+
+    changed_at = clustering.get("createdAt") or datetime.datetime.utcnow()
+    changed = sync_assignments(db, profile, results, version, changed_at)
+    trimmed = trim_snapshots(db, profile, retention)
+
+    return {
+        "created": created,
+        "version": version,
+        "changed": changed,
+        "trimmed": trimmed,
+    }
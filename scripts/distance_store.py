@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+import datetime
+import hashlib
+import json
+import numpy as np
+from bson import Binary, ObjectId
+
+DISTANCE_FORMAT = "condensed-uint16-le"
+DISTANCE_DTYPE = np.dtype("<u2")
+DISTANCE_MAX = np.iinfo(DISTANCE_DTYPE).max
+CHUNK_COLLECTION = "distance_chunks"
+CHUNK_BYTES = 4 * 1024 * 1024
+
+
+def condense(matrix):
+    """
+    Return the upper triangle (excluding the diagonal) of a square distance
+    matrix as a flat little-endian uint16 array, row by row.
+    Distances above the uint16 range are clipped.
+    """
+    matrix = np.asarray(matrix)
+    if matrix.size == 0:
+        matrix = matrix.reshape(0, 0)
+    if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1]:
+        raise ValueError(f"Distance matrix must be square, got {matrix.shape}")
+
+    condensed = matrix[np.triu_indices(matrix.shape[0], k=1)]
+
+    if condensed.size and (condensed.min() < 0 or condensed.max() > DISTANCE_MAX):
+        print(f"Clipping distances outside 0-{DISTANCE_MAX} to fit uint16 storage")
+        condensed = np.clip(condensed, 0, DISTANCE_MAX)
+
+    return condensed.astype(DISTANCE_DTYPE)
+
+
+def row_offset(row, n):
+    """Position in the condensed array of the first value of a matrix row."""
+    return row * n - row * (row + 1) // 2
+
+
+def row_blocks(n, chunk_bytes=CHUNK_BYTES):
+    """
+    Split the condensed rows of an n x n matrix into (row_start, row_end) blocks
+    holding at most chunk_bytes each (a single longer row gets its own block).
+    """
+    max_values = max(1, chunk_bytes // DISTANCE_DTYPE.itemsize)
+    row_start = 0
+
+    while row_start < n - 1:
+        row_end = row_start + 1
+        while (
+            row_end < n - 1
+            and row_offset(row_end + 1, n) - row_offset(row_start, n) <= max_values
+        ):
+            row_end += 1
+        yield row_start, row_end
+        row_start = row_end
+
+
+def distance_hash(samples, condensed, newick):
+    """Hash of a stored distance matrix: its samples, values and Newick tree."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(list(samples), separators=(",", ":")).encode("utf-8"))
+    digest.update(np.ascontiguousarray(condensed).tobytes())
+    digest.update((newick or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def store_distance(
+    db, profile, samples, matrix, newick, created_at=None, chunk_bytes=CHUNK_BYTES
+):
+    """
+    Store a distance matrix as a header document in `distance` and row-block
+    chunk documents in `distance_chunks`.
+
+    Chunks are written under a new version id before the header points to
+    them, and chunks of earlier versions are removed afterwards, so readers
+    never see a header with partially written chunks. Nothing is written when
+    the stored matrix has the same hash; None is returned in that case,
+    otherwise the number of chunks.
+    """
+    n = len(samples)
+    condensed = condense(matrix)
+    if condensed.size != n * (n - 1) // 2:
+        raise ValueError(f"Distance matrix does not match the {n} samples of {profile}")
+
+    matrix_hash = distance_hash(samples, condensed, newick)
+    stored = db["distance"].find_one({"analysis_profile": profile}, {"matrix_hash": 1})
+    if stored and stored.get("matrix_hash") == matrix_hash:
+        return None
+
+    version = ObjectId()
+    chunks = db[CHUNK_COLLECTION]
+
+    documents = []
+    for chunk, (row_start, row_end) in enumerate(row_blocks(n, chunk_bytes)):
+        values = condensed[row_offset(row_start, n) : row_offset(row_end, n)]
+        documents.append(
+            {
+                "analysis_profile": profile,
+                "version": version,
+                "chunk": chunk,
+                "row_start": row_start,
+                "row_end": row_end,
+                "data": Binary(values.tobytes()),
+            }
+        )
+
+    if documents:
+        chunks.insert_many(documents, ordered=False)
+
+    db["distance"].update_one(
+        {"analysis_profile": profile},
+        {
+            "$set": {
+                "analysis_profile": profile,
+                "samples": list(samples),
+                "newick": newick,
+                "format": DISTANCE_FORMAT,
+                "version": version,
+                "chunks": len(documents),
+                "matrix_hash": matrix_hash,
+                "createdAt": created_at or datetime.datetime.utcnow(),
+            },
+            "$unset": {"matrix": ""},
+        },
+        upsert=True,
+    )
+
+    chunks.delete_many({"analysis_profile": profile, "version": {"$ne": version}})
+
+    return len(documents)
+
+
+def _load_rows(db, header, rows):
+    """Return {row: condensed values} for the requested matrix rows."""
+    n = len(header["samples"])
+    rows = sorted(set(rows))
+    if not rows:
+        return {}
+
+    query = {
+        "analysis_profile": header["analysis_profile"],
+        "version": header["version"],
+        "row_start": {"$lte": rows[-1]},
+        "row_end": {"$gt": rows[0]},
+    }
+
+    loaded = {}
+    for doc in db[CHUNK_COLLECTION].find(query).sort("chunk", 1):
+        values = np.frombuffer(doc["data"], dtype=DISTANCE_DTYPE)
+        base = row_offset(doc["row_start"], n)
+        for row in rows:
+            if doc["row_start"] <= row < doc["row_end"]:
+                start = row_offset(row, n) - base
+                loaded[row] = values[start : start + n - row - 1]
+
+    return loaded
+
+
+def load_distance_header(db, profile):
+    """Return the distance header document of a profile, or None."""
+    return db["distance"].find_one({"analysis_profile": profile})
+
+
+def load_distance_matrix(db, profile):
+    """
+    Read the stored distance matrix of a profile.
+    Returns (samples, matrix) with matrix as a square uint16 array, or
+    (None, None) if no distance data is stored. Documents stored before
+    chunked storage (with an inline `matrix`) are read as well.
+    """
+    header = load_distance_header(db, profile)
+    if not header:
+        return None, None
+
+    samples = header.get("samples") or []
+    if "matrix" in header:
+        return samples, np.asarray(header["matrix"], dtype=DISTANCE_DTYPE)
+
+    n = len(samples)
+    condensed = np.empty(n * (n - 1) // 2, dtype=DISTANCE_DTYPE)
+    query = {"analysis_profile": profile, "version": header.get("version")}
+    for doc in db[CHUNK_COLLECTION].find(query).sort("chunk", 1):
+        start = row_offset(doc["row_start"], n)
+        end = row_offset(doc["row_end"], n)
+        condensed[start:end] = np.frombuffer(doc["data"], dtype=DISTANCE_DTYPE)
+
+    matrix = np.zeros((n, n), dtype=DISTANCE_DTYPE)
+    upper = np.triu_indices(n, k=1)
+    matrix[upper] = condensed
+    matrix.T[upper] = condensed
+
+    return samples, matrix
+
+
+def load_distance_block(db, profile, row_ids, column_ids=None):
+    """
+    Read a sub-block of the stored distance matrix of a profile, only fetching
+    the chunks that hold the requested samples.
+    Returns a len(row_ids) x len(column_ids) uint16 array (columns default to
+    the rows). Raises KeyError for samples without stored distances.
+    """
+    header = load_distance_header(db, profile)
+    if not header:
+        raise KeyError(f"No distance data stored for {profile}")
+
+    column_ids = row_ids if column_ids is None else column_ids
+    index = {sample_id: i for i, sample_id in enumerate(header.get("samples") or [])}
+    rows = np.array([index[s] for s in row_ids], dtype=np.int64)
+    columns = np.array([index[s] for s in column_ids], dtype=np.int64)
+
+    if "matrix" in header:
+        matrix = np.asarray(header["matrix"], dtype=DISTANCE_DTYPE)
+        return matrix[np.ix_(rows, columns)]
+
+    low = np.minimum(rows[:, None], columns[None, :])
+    high = np.maximum(rows[:, None], columns[None, :])
+
+    block = np.zeros(low.shape, dtype=DISTANCE_DTYPE)
+    loaded = _load_rows(db, header, np.unique(low[low != high]).tolist())
+    for row, values in loaded.items():
+        mask = (low == row) & (high != row)
+        block[mask] = values[high[mask] - row - 1]
+
+    return block
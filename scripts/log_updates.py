@@ -1,4 +1,68 @@
 import datetime
+from pymongo import UpdateOne
+
+
+class SampleLogBuffer:
+    """
+    Collect sample events for the 'logs' collection and write them in one bulk_write.
+
+    Events for the same sample are combined into a single upsert that creates the
+    log entry if it is missing ($setOnInsert) and appends the update entries
+    ($push), so no read is needed before writing.
+    """
+
+    def __init__(self, db):
+        self.collection = db["logs"]
+        self._events = {}
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(
+        self, sample_id, profile, is_insert=False, changes_dict=None, changed_by=None
+    ):
+        if not is_insert and not changes_dict:
+            return
+
+        now = datetime.datetime.utcnow().isoformat()
+        event = self._events.setdefault(
+            sample_id,
+            {"profile": profile, "added_at": now, "updates": []},
+        )
+
+        if changes_dict:
+            update_entry = {
+                "date": now,
+                "updated_fields": list(changes_dict.keys()),
+                "changes": changes_dict,
+            }
+
+            if changed_by:
+                update_entry["changed_by"] = changed_by
+
+            event["updates"].append(update_entry)
+
+    def flush(self):
+        """Write all buffered events and clear the buffer."""
+        if not self._events:
+            return None
+
+        operations = []
+        for sample_id, event in self._events.items():
+            on_insert = {"profile": event["profile"], "added_at": event["added_at"]}
+
+            if event["updates"]:
+                update = {
+                    "$setOnInsert": on_insert,
+                    "$push": {"updates": {"$each": event["updates"]}},
+                }
+            else:
+                update = {"$setOnInsert": {**on_insert, "updates": []}}
+
+            operations.append(UpdateOne({"sample_id": sample_id}, update, upsert=True))
+
+        self._events = {}
+        return self.collection.bulk_write(operations, ordered=False)
 
 
 def log_sample_event(
@@ -7,39 +71,12 @@ def log_sample_event(
     """
     Insert or update a sample entry in the 'logs' collection.
     """
-    collection = db["logs"]
-    now = datetime.datetime.utcnow().isoformat()
-
-    existing = collection.find_one({"sample_id": sample_id})
-
-    if not existing and is_insert:
-        doc = {
-            "sample_id": sample_id,
-            "profile": profile,
-            "added_at": now,
-            "updates": [],
-        }
-        collection.insert_one(doc)
-
-    if changes_dict:
-        update_entry = {
-            "date": now,
-            "updated_fields": list(changes_dict.keys()),
-            "changes": changes_dict,
-        }
-
-        if changed_by:
-            update_entry["changed_by"] = changed_by
-
-        if existing:
-            collection.update_one(
-                {"_id": existing["_id"]}, {"$push": {"updates": update_entry}}
-            )
-        else:
-            doc = {
-                "sample_id": sample_id,
-                "profile": profile,
-                "added_at": now,
-                "updates": [update_entry],
-            }
-            collection.insert_one(doc)
+    buffer = SampleLogBuffer(db)
+    buffer.add(
+        sample_id,
+        profile,
+        is_insert=is_insert,
+        changes_dict=changes_dict,
+        changed_by=changed_by,
+    )
+    buffer.flush()
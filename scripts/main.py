@@ -3,19 +3,41 @@ import argparse
 import os
 import tempfile
 import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv, find_dotenv
-from pymongo import MongoClient
 
 from api import (
+    BonsaiClient,
     load_credentials,
     get_access_token,
-    fetch_samples,
     authenticate_mimosa_user,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_PAGE_SIZE,
+)
+from upload import upload_similarity, MimosaUploader, DEFAULT_MONGO_POOL_SIZE
+from clustering_store import DEFAULT_CLUSTERING_RETENTION
+from sample_catalogue import SampleCatalogue
+from sample_cache import (
+    SampleDetailCache,
+    DEFAULT_CACHE_DIR,
+    DEFAULT_CACHE_MAX_ENTRIES,
 )
-from upload import upload_similarity
 from sample_checks import get_new_sample_ids, prompt_if_no_new_samples
-from process_similarity import process_similarity
+from process_similarity import (
+    process_similarity,
+    DEFAULT_SIMILARITY_WORKERS,
+    DEFAULT_JOB_TIMEOUT,
+)
+from similarity_engine import process_local_similarity
+from process_samples import DEFAULT_FETCH_WORKERS
 from MIMOSA import mimosa
+from run_reportree import (
+    reportree_resource_limits,
+    resolve_reportree_backend,
+    parse_memory,
+    REPORTREE_BACKENDS,
+)
 
 from mimosa_state import (
     init_pipeline_state,
@@ -24,6 +46,7 @@ from mimosa_state import (
     render_runtime_summary,
 )
 from mimosa_runner import run_stage
+from mongo_indexes import ensure_indexes, check_indexes
 
 dotenv_path = find_dotenv(filename=".env", usecwd=True)
 if not dotenv_path:
@@ -67,11 +90,131 @@ def parse_args():
         action="store_true",
         help="Skip similarity and related uploads",
     )
+    parser.add_argument(
+        "--fetch_workers",
+        "--fetch-workers",
+        type=int,
+        default=DEFAULT_FETCH_WORKERS,
+        help="Number of concurrent requests used to fetch samples and sample details from Bonsai.",
+    )
+    parser.add_argument(
+        "--page_size",
+        type=int,
+        default=DEFAULT_PAGE_SIZE,
+        help="Number of samples requested per page when listing samples from Bonsai.",
+    )
+    parser.add_argument(
+        "--similarity_engine",
+        "--similarity-engine",
+        choices=["bonsai", "local"],
+        default="bonsai",
+        help="Compute similarity with Bonsai jobs or locally from allele profiles.",
+    )
+    parser.add_argument(
+        "--incremental_similarity",
+        "--incremental-similarity",
+        action="store_true",
+        help="Compute similarity only for new samples and update the stored "
+        "similarity of existing samples they rank among.",
+    )
+    parser.add_argument(
+        "--clustering_retention",
+        type=int,
+        default=DEFAULT_CLUSTERING_RETENTION,
+        help="Number of clustering snapshots kept per profile "
+        f"(default: {DEFAULT_CLUSTERING_RETENTION}, 0 keeps all).",
+    )
+    parser.add_argument(
+        "--similarity_workers",
+        type=int,
+        default=DEFAULT_SIMILARITY_WORKERS,
+        help="Maximum number of similarity jobs outstanding in Bonsai at once.",
+    )
+    parser.add_argument(
+        "--similarity_timeout",
+        type=int,
+        default=DEFAULT_JOB_TIMEOUT,
+        help="Seconds to wait for a similarity job before re-queueing it.",
+    )
+    parser.add_argument(
+        "--mongo_pool_size",
+        type=int,
+        default=DEFAULT_MONGO_POOL_SIZE,
+        help="Maximum number of pooled MongoDB connections used for uploads.",
+    )
+    parser.add_argument(
+        "--profile_workers",
+        "--profile-workers",
+        type=int,
+        default=1,
+        help="Number of profiles processed concurrently, including their "
+        "ReporTree runs (default: 1).",
+    )
+    parser.add_argument(
+        "--reportree_backend",
+        "--reportree-backend",
+        choices=REPORTREE_BACKENDS,
+        default="auto",
+        help="How ReporTree is run: exec in the running reportree service "
+        "container, run a new container, or a local ReporTree installation. "
+        "auto uses exec when the service is running, otherwise run.",
+    )
+    parser.add_argument(
+        "--reportree_cpus",
+        type=float,
+        default=None,
+        help="Total CPUs shared by concurrent ReporTree containers "
+        "(default: no limit).",
+    )
+    parser.add_argument(
+        "--reportree_memory",
+        default=None,
+        help="Total memory shared by concurrent ReporTree containers, e.g. 8g "
+        "(default: no limit).",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        default=DEFAULT_CACHE_DIR,
+        help="Directory for the local cache of Bonsai sample details.",
+    )
+    parser.add_argument(
+        "--cache_max_entries",
+        type=int,
+        default=DEFAULT_CACHE_MAX_ENTRIES,
+        help="Maximum number of samples kept in the local cache.",
+    )
+    parser.add_argument(
+        "--no_cache",
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write the local sample details cache.",
+    )
+    parser.add_argument(
+        "--refresh_cache",
+        "--refresh-cache",
+        action="store_true",
+        help="Ignore cached sample details and fetch all samples again.",
+    )
 
     args = parser.parse_args()
 
     if args.save_files and not args.output:
         parser.error("--save_files requires --output")
+    if args.fetch_workers < 1:
+        parser.error("--fetch_workers must be at least 1")
+    if args.page_size < 1:
+        parser.error("--page_size must be at least 1")
+    if args.similarity_workers < 1:
+        parser.error("--similarity_workers must be at least 1")
+    if args.profile_workers < 1:
+        parser.error("--profile_workers must be at least 1")
+    if args.reportree_cpus is not None and args.reportree_cpus <= 0:
+        parser.error("--reportree_cpus must be positive")
+    if args.reportree_memory is not None:
+        try:
+            parse_memory(args.reportree_memory)
+        except ValueError as e:
+            parser.error(f"--reportree_memory: {e}")
 
     if "All" in args.profile:
         target_profiles = AVAILABLE_PROFILES
@@ -86,16 +229,10 @@ def parse_args():
     return args, target_profiles
 
 
-def get_analyzed_sample_ids():
-    mongo_uri = os.getenv("MONGO_URI") or os.getenv("MONGO_URI_DOCKER")
-    db_name = os.getenv("MONGO_DB_NAME")
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
-
+def get_analyzed_sample_ids(db):
     similarity_ids = set(db["similarities"].distinct("ID"))
     feature_ids = set(db["features"].distinct("properties.ID"))
 
-    client.close()
     return similarity_ids | feature_ids
 
 
@@ -123,8 +260,23 @@ def main():
     render_pipeline_state(pipeline_state)
 
     credentials = load_credentials(args.credentials)
-    token = get_access_token(credentials)
+    bonsai_client = BonsaiClient(
+        credentials["bonsai_api_url"],
+        pool_size=max(args.fetch_workers * args.profile_workers, DEFAULT_POOL_SIZE),
+    )
+    get_access_token(credentials, bonsai_client)
+
+    detail_cache = (
+        None
+        if args.no_cache
+        else SampleDetailCache(
+            args.cache_dir,
+            max_entries=args.cache_max_entries,
+            refresh=args.refresh_cache,
+        )
+    )
     upload_token = authenticate_mimosa_user(credentials)
+    uploader = MimosaUploader(upload_token, pool_size=args.mongo_pool_size)
 
     base_dir = (
         args.output if args.save_files else tempfile.mkdtemp(prefix="mimosa_tmp_")
@@ -133,10 +285,19 @@ def main():
         os.makedirs(base_dir, exist_ok=True)
 
     all_target_ids = set()
+    all_new_ids = set()
+    profile_jobs = []
+    index_problems = []
 
     try:
-        all_samples = fetch_samples(credentials["bonsai_api_url"], token)
-        analyzed_ids = get_analyzed_sample_ids()
+        index_problems = ensure_indexes(uploader.db) + check_indexes(uploader.db)
+
+        catalogue = SampleCatalogue.fetch(
+            bonsai_client,
+            page_size=args.page_size,
+            workers=args.fetch_workers,
+        )
+        analyzed_ids = get_analyzed_sample_ids(uploader.db)
         any_new_samples = False
 
         for profile in target_profiles:
@@ -147,38 +308,81 @@ def main():
         for profile in target_profiles:
             if args.update:
                 target_ids = {
-                    s["sample_id"]
-                    for s in all_samples
-                    if s.get("profile") == profile
-                    and s.get("sample_id") in analyzed_ids
+                    sample_id
+                    for sample_id in catalogue.profile_ids(profile)
+                    if sample_id in analyzed_ids
                 }
                 if not target_ids:
                     print(f"No samples to update for profile '{profile}'.")
                     continue
             else:
-                new_ids = get_new_sample_ids(all_samples, analyzed_ids, profile)
+                new_ids = get_new_sample_ids(catalogue, analyzed_ids, profile)
                 if not new_ids:
                     if not prompt_if_no_new_samples(profile, new_ids):
                         continue
                     target_ids = analyzed_ids
                 else:
                     target_ids = new_ids
+                    all_new_ids.update(new_ids)
                     any_new_samples = True
 
             pipeline_state[profile]["fetch_samples"]["count"] = len(target_ids)
             all_target_ids.update(target_ids)
-
-            profile_dir = os.path.join(base_dir, profile)
-            mimosa(
-                profile,
-                profile_dir,
-                args,
-                credentials,
-                token,
-                target_ids,
-                upload_token,
-                pipeline_state,
+            profile_jobs.append((profile, target_ids))
+
+        # Profiles are selected (and prompted for) one at a time above, then
+        # processed concurrently with the ReporTree budget split between them.
+        profile_workers = min(args.profile_workers, max(1, len(profile_jobs)))
+        reportree_options = reportree_resource_limits(
+            args.reportree_cpus, args.reportree_memory, profile_workers
+        )
+        # ReporTree does not run when only updating metadata, so its backend
+        # is only resolved (and checked) when a profile will run it.
+        if profile_jobs and not args.update:
+            reportree_options["backend"] = resolve_reportree_backend(
+                args.reportree_backend
             )
+            if reportree_options["backend"] == "exec" and (
+                args.reportree_cpus or args.reportree_memory
+            ):
+                print(
+                    "ReporTree runs in the service container, whose own limits "
+                    "apply instead of --reportree_cpus/--reportree_memory."
+                )
+
+        # Similarity alleles collected while processing the profiles, reused by
+        # the local similarity engine instead of fetching every sample again.
+        allele_profiles = {} if args.similarity_engine == "local" else None
+
+        # Profiles are submitted as workers free up and no new profile starts
+        # after one fails, so a failure stops the run as the sequential loop
+        # did; profiles already running finish first.
+        pending = deque(profile_jobs)
+        running = set()
+        with ThreadPoolExecutor(max_workers=profile_workers) as executor:
+            while pending or running:
+                while pending and len(running) < profile_workers:
+                    profile, target_ids = pending.popleft()
+                    running.add(
+                        executor.submit(
+                            mimosa,
+                            profile,
+                            os.path.join(base_dir, profile),
+                            args,
+                            bonsai_client,
+                            catalogue,
+                            target_ids,
+                            uploader,
+                            pipeline_state,
+                            detail_cache=detail_cache,
+                            reportree_options=reportree_options,
+                            allele_profiles=allele_profiles,
+                        )
+                    )
+
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
 
         run_similarity = True
 
@@ -188,6 +392,10 @@ def main():
         if args.skip_similarity or not all_target_ids:
             run_similarity = False
 
+        elif args.incremental_similarity and not any_new_samples:
+            print("\nNo new samples detected — similarity is up to date.")
+            run_similarity = False
+
         elif not any_new_samples:
             answer = (
                 input(
@@ -203,8 +411,17 @@ def main():
         if run_similarity:
             print("\nRunning similarity")
 
+            # In incremental mode only new samples are computed; existing samples
+            # are updated through the neighbours of the new ones on upload.
+            if args.incremental_similarity:
+                similarity_ids = sorted(all_new_ids)
+                neighbours = {}
+            else:
+                similarity_ids = sorted(all_target_ids)
+                neighbours = None
+
             pipeline_state[GLOBAL_PROFILE]["run_similarity"]["total"] = len(
-                all_target_ids
+                similarity_ids
             )
             pipeline_state[GLOBAL_PROFILE]["run_similarity"]["done"] = 0
             render_pipeline_state(pipeline_state)
@@ -213,38 +430,72 @@ def main():
                 pipeline_state[GLOBAL_PROFILE]["run_similarity"]["done"] += 1
                 render_pipeline_state(pipeline_state)
 
-            run_stage(
-                pipeline_state,
-                GLOBAL_PROFILE,
-                "run_similarity",
-                process_similarity,
-                credentials["bonsai_api_url"],
-                token,
-                sorted(all_target_ids),
-                base_dir,
-                "combined",
-                save_files=True,
-                progress_callback=similarity_progress,
-            )
-
-            similarity_path = os.path.join(base_dir, "combined_similarity.json")
+            if args.similarity_engine == "local":
+                similarity = run_stage(
+                    pipeline_state,
+                    GLOBAL_PROFILE,
+                    "run_similarity",
+                    process_local_similarity,
+                    bonsai_client,
+                    catalogue,
+                    similarity_ids,
+                    base_dir,
+                    "combined",
+                    fetch_workers=args.fetch_workers,
+                    cache=detail_cache,
+                    save_files=args.save_files,
+                    progress_callback=similarity_progress,
+                    report=pipeline_state[GLOBAL_PROFILE]["run_similarity"],
+                    neighbours=neighbours,
+                    allele_profiles=allele_profiles,
+                )
+            else:
+                similarity = run_stage(
+                    pipeline_state,
+                    GLOBAL_PROFILE,
+                    "run_similarity",
+                    process_similarity,
+                    bonsai_client,
+                    similarity_ids,
+                    base_dir,
+                    "combined",
+                    job_timeout=args.similarity_timeout,
+                    max_in_flight=args.similarity_workers,
+                    save_files=args.save_files,
+                    progress_callback=similarity_progress,
+                    report=pipeline_state[GLOBAL_PROFILE]["run_similarity"],
+                )
+                # Bonsai only returns the top matches, so existing samples can
+                # only be updated from those.
+                if neighbours is not None:
+                    neighbours = {item["ID"]: item["similar"] for item in similarity}
 
             run_stage(
                 pipeline_state,
                 GLOBAL_PROFILE,
                 "upload_similarity",
                 upload_similarity,
-                similarity_path,
-                upload_token=upload_token,
-                count=len(all_target_ids),
+                data=similarity,
+                uploader=uploader,
+                neighbours=neighbours,
+                count=len(similarity),
             )
 
     finally:
+        bonsai_client.close()
+        uploader.close()
+        if detail_cache is not None:
+            detail_cache.close()
         if not args.save_files and os.path.exists(base_dir):
             shutil.rmtree(base_dir, ignore_errors=True)
 
     render_runtime_summary(pipeline_state)
 
+    if index_problems:
+        print("\nIndex problems")
+        for problem in index_problems:
+            print(f"  {problem}")
+
 
 if __name__ == "__main__":
     main()
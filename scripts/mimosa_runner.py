@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 import time
-from mimosa_state import Status, render_pipeline_state
+from mimosa_state import Status, render_pipeline_state, STATE_LOCK
 
 
 def run_stage(
@@ -15,30 +15,40 @@ def run_stage(
 ):
     entry = pipeline_state[profile][stage]
 
-    entry["status"] = Status.RUNNING
-    entry["started_at"] = time.monotonic()
-    render_pipeline_state(pipeline_state)
+    with STATE_LOCK:
+        entry["status"] = Status.RUNNING
+        entry["started_at"] = time.monotonic()
+        render_pipeline_state(pipeline_state)
 
     try:
         result = fn(*args, **kwargs)
 
-        entry["status"] = Status.DONE
-        if count:
-            entry["count"] = count
+        with STATE_LOCK:
+            entry["status"] = Status.DONE
+            if count:
+                entry["count"] = count
 
-        end = time.monotonic()
-        entry["finished_at"] = end
-        entry["duration"] = end - entry["started_at"]
+            end = time.monotonic()
+            entry["finished_at"] = end
+            entry["duration"] = end - entry["started_at"]
 
-        render_pipeline_state(pipeline_state)
+            render_pipeline_state(pipeline_state)
         return result
 
     except Exception:
-        entry["status"] = Status.FAILED
+        with STATE_LOCK:
+            entry["status"] = Status.FAILED
 
-        end = time.monotonic()
-        entry["finished_at"] = end
-        entry["duration"] = end - entry["started_at"]
+            end = time.monotonic()
+            entry["finished_at"] = end
+            entry["duration"] = end - entry["started_at"]
 
-        render_pipeline_state(pipeline_state)
+            render_pipeline_state(pipeline_state)
         raise
+
+
+def skip_stages(pipeline_state, profile, *stages):
+    """Mark stages of a profile as skipped, under the state lock."""
+    with STATE_LOCK:
+        for stage in stages:
+            pipeline_state[profile][stage]["status"] = Status.SKIPPED
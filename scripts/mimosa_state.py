@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import threading
 from enum import Enum
 
 
@@ -63,6 +64,10 @@ _STATUS_ORDER = {
 
 GLOBAL_PROFILE = "__global__"
 
+# Profiles may run concurrently; stage updates and rendering of the shared
+# pipeline state are serialised through this lock.
+STATE_LOCK = threading.RLock()
+
 
 def init_pipeline_state(profiles, mode="full"):
     state = {
@@ -72,6 +77,8 @@ def init_pipeline_state(profiles, mode="full"):
                 "count": 0,
                 "done": 0,
                 "total": 0,
+                "failed": 0,
+                "timed_out": 0,
                 "started_at": None,
                 "finished_at": None,
                 "duration": None,
@@ -113,6 +120,11 @@ LABEL_WIDTH = 26
 
 
 def render_pipeline_state(state):
+    with STATE_LOCK:
+        _render_pipeline_state(state)
+
+
+def _render_pipeline_state(state):
     os.system("clear")
 
     mode = state.get("_mode", "full")
@@ -184,6 +196,9 @@ def render_pipeline_state(state):
         if label == "Similarity analysis":
             done, total = _aggregate_progress(entries)
             suffix = f" ({done}/{total})" if total else ""
+            timed_out = global_state["run_similarity"].get("timed_out", 0)
+            if timed_out:
+                suffix += f", {timed_out} timed out"
             print(f"  {label:<{LABEL_WIDTH}}{status}{suffix}")
         else:
             print(f"  {label:<{LABEL_WIDTH}}{status}")
@@ -220,4 +235,11 @@ def render_runtime_summary(state):
                 f"{'Similarity':<{LABEL_WIDTH}}" f"{format_duration(similarity_time)}"
             )
 
+            run_similarity = global_state["run_similarity"]
+            if run_similarity.get("failed") or run_similarity.get("timed_out"):
+                print(
+                    f"  {run_similarity.get('failed', 0)} failed, "
+                    f"{run_similarity.get('timed_out', 0)} timed out"
+                )
+
     print(f"\n{'Total':<{LABEL_WIDTH}}" f"{format_duration(total_run_time)}")
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+import os
+import argparse
+from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from dotenv import load_dotenv, find_dotenv
+
+dotenv_path = find_dotenv(filename=".env", usecwd=True)
+if not dotenv_path:
+    raise FileNotFoundError("Could not find project-root .env file.")
+load_dotenv(dotenv_path)
+
+mongo_uri = os.getenv("MONGO_URI") or os.getenv("MONGO_URI_DOCKER")
+db_name = os.getenv("MONGO_DB_NAME")
+
+# Server error codes for an existing index with the same name but other options.
+INDEX_CONFLICT_CODES = {85, 86}
+
+# Index names follow MongoDB's defaults so that indexes declared in the backend
+# schemas (e.g. distance.analysis_profile) are recognised rather than duplicated.
+# Log entries are upserted by sample_id from concurrent profiles, so that index
+# must be unique for the upserts not to create duplicates.
+INDEXES = {
+    "features": [
+        IndexModel([("properties.ID", ASCENDING)], unique=True),
+    ],
+    "similarities": [
+        IndexModel([("ID", ASCENDING)], unique=True),
+    ],
+    "logs": [
+        IndexModel([("sample_id", ASCENDING)], unique=True),
+    ],
+    "distance": [
+        IndexModel([("analysis_profile", ASCENDING)], unique=True),
+    ],
+    "distance_chunks": [
+        IndexModel(
+            [
+                ("analysis_profile", ASCENDING),
+                ("version", ASCENDING),
+                ("chunk", ASCENDING),
+            ],
+            unique=True,
+        ),
+    ],
+    "clustering": [
+        IndexModel([("analysis_profile", ASCENDING), ("createdAt", DESCENDING)]),
+    ],
+    "cluster_assignments": [
+        IndexModel(
+            [
+                ("analysis_profile", ASCENDING),
+                ("ID", ASCENDING),
+                ("Partition", ASCENDING),
+            ],
+            unique=True,
+        ),
+        IndexModel([("ID", ASCENDING)]),
+    ],
+}
+
+# Representative queries issued by the pipeline and the backend, used to check
+# that the query planner picks an index.
+QUERY_PLANS = [
+    ("features", {"properties.ID": ""}, None),
+    ("similarities", {"ID": ""}, None),
+    ("logs", {"sample_id": ""}, None),
+    ("distance", {"analysis_profile": ""}, None),
+    (
+        "distance_chunks",
+        {"analysis_profile": "", "version": ""},
+        [("chunk", ASCENDING)],
+    ),
+    ("clustering", {"analysis_profile": ""}, [("createdAt", DESCENDING)]),
+    ("cluster_assignments", {"analysis_profile": ""}, None),
+    ("cluster_assignments", {"ID": ""}, None),
+]
+
+
+def _plan_stages(plan):
+    """Yield every stage name in an explain() plan tree."""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _plan_stages(value)
+
+
+def find_duplicate_keys(collection, index, limit=5):
+    """Return up to limit key values held by more than one document."""
+    keys = list(index.document["key"])
+    pipeline = [
+        {"$group": {"_id": {key: f"${key}" for key in keys}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": limit},
+    ]
+    return [doc["_id"] for doc in collection.aggregate(pipeline, allowDiskUse=True)]
+
+
+def _rebuild_index(collection, index):
+    """
+    Replace an existing index of the same name with index. A unique index is
+    only rebuilt when no documents share its key, so the existing index is
+    never dropped for a build that would fail. Returns a problem or None.
+    """
+    name = index.document["name"]
+    if index.document.get("unique"):
+        duplicates = find_duplicate_keys(collection, index)
+        if duplicates:
+            return (
+                f"{collection.name}.{name}: not rebuilt, duplicate keys "
+                f"{duplicates} must be removed first"
+            )
+
+    collection.drop_index(name)
+    collection.create_indexes([index])
+    return None
+
+
+def ensure_indexes(db, rebuild=False):
+    """
+    Create the indexes the pipeline relies on. Safe to run repeatedly.
+    An existing index with the same name but other options (e.g. a non-unique
+    logs.sample_id index) is reported, and only dropped and rebuilt with
+    rebuild=True. Returns a list of problems, empty if all indexes are in place.
+    """
+    problems = []
+
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        for index in indexes:
+            name = index.document["name"]
+            try:
+                collection.create_indexes([index])
+            except OperationFailure as e:
+                if e.code not in INDEX_CONFLICT_CODES:
+                    problems.append(
+                        f"{collection_name}.{name}: {e.details.get('errmsg', e)}"
+                    )
+                elif not rebuild:
+                    problems.append(
+                        f"{collection_name}.{name}: exists with other options, "
+                        "run `mongo_indexes.py ensure --rebuild` to replace it"
+                    )
+                else:
+                    try:
+                        problem = _rebuild_index(collection, index)
+                    except OperationFailure as e:
+                        problem = (
+                            f"{collection_name}.{name}: "
+                            f"{e.details.get('errmsg', e)}"
+                        )
+                    if problem:
+                        problems.append(problem)
+
+    return problems
+
+
+def check_indexes(db):
+    """
+    Report missing indexes and representative queries that would scan a
+    whole collection. Returns a list of problems, empty if none were found.
+    """
+    problems = []
+
+    for collection_name, indexes in INDEXES.items():
+        existing = db[collection_name].index_information()
+        for index in indexes:
+            name = index.document["name"]
+            if name not in existing:
+                problems.append(f"{collection_name}.{name}: missing")
+
+    for collection_name, query, sort in QUERY_PLANS:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+
+        winning_plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in set(_plan_stages(winning_plan)):
+            problems.append(f"{collection_name} {query}: COLLSCAN")
+
+    return problems
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Manage MongoDB indexes used by the MIMOSA pipeline."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ensure = subparsers.add_parser(
+        "ensure", help="Create missing indexes, then check query plans."
+    )
+    ensure.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Drop and rebuild indexes that exist with other options, unless "
+        "documents would violate a unique index.",
+    )
+    subparsers.add_parser(
+        "check", help="Report missing indexes and queries using COLLSCAN."
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    client = MongoClient(mongo_uri)
+    db = client[db_name]
+
+    try:
+        problems = (
+            ensure_indexes(db, rebuild=args.rebuild) if args.command == "ensure" else []
+        )
+        problems += check_indexes(db)
+    finally:
+        client.close()
+
+    if problems:
+        for problem in problems:
+            print(problem)
+        raise SystemExit(1)
+
+    print("All indexes are in place.")
+
+
+if __name__ == "__main__":
+    main()
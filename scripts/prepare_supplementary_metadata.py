@@ -2,7 +2,13 @@
 import os
 import argparse
 import pandas as pd
-from api import load_credentials, get_access_token, fetch_samples, fetch_sample_details
+from api import (
+    BonsaiClient,
+    load_credentials,
+    get_access_token,
+    iter_samples,
+)
+from process_samples import fetch_sample_details_concurrently
 from main import AVAILABLE_PROFILES
 
 
@@ -23,24 +29,21 @@ def parse_args():
     return parser.parse_args()
 
 
-def prepare_supplementary(bonsai_api_url, token, output_folder, profile):
-    samples = fetch_samples(bonsai_api_url, token)
-    matched_samples = [s for s in samples if s.get("profile") == profile]
-
-    if not matched_samples:
-        print(f"No samples found for profile: {profile}")
-        return
+def prepare_supplementary(client, output_folder, profile):
+    matched_ids = (
+        s.get("sample_id")
+        for s in iter_samples(client)
+        if s.get("profile") == profile and s.get("sample_id")
+    )
 
     output_path = os.path.join(output_folder, f"supplementary_metadata_{profile}.csv")
     rows = []
 
-    for sample in matched_samples:
-        sample_id = sample.get("sample_id")
-        if not sample_id:
+    for sample_id, details in fetch_sample_details_concurrently(client, matched_ids):
+        if details is None:
             continue
 
-        details = fetch_sample_details(bonsai_api_url, token, sample_id)
-        lims_id = details.get("lims_id", "Unknown")
+        lims_id = details.get("lims_id") or "Unknown"
 
         rows.append(
             {
@@ -52,6 +55,10 @@ def prepare_supplementary(bonsai_api_url, token, output_folder, profile):
             }
         )
 
+    if not rows:
+        print(f"No samples found for profile: {profile}")
+        return
+
     df = pd.DataFrame(rows)
     df.to_csv(output_path, index=False)
     print(f"Supplementary metadata saved to: {output_path}")
@@ -60,14 +67,13 @@ def prepare_supplementary(bonsai_api_url, token, output_folder, profile):
 def main():
     args = parse_args()
     credentials = load_credentials(args.credentials)
-    token = get_access_token(credentials)
 
     if not os.path.exists(args.output):
         os.makedirs(args.output)
 
-    prepare_supplementary(
-        credentials["bonsai_api_url"], token, args.output, args.profile
-    )
+    with BonsaiClient(credentials["bonsai_api_url"]) as client:
+        get_access_token(credentials, client)
+        prepare_supplementary(client, args.output, args.profile)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,13 @@
 #!/usr/bin/env python3
 import os
 import pandas as pd
-from api import fetch_samples, fetch_sample_details
+from concurrent.futures import ThreadPoolExecutor
+from api import fetch_sample_details
+from cgmlst_matrix import CgmlstMatrix
+from sample_cache import slim_sample_details, sample_fingerprint
+from process_similarity import SIMILARITY_TYPING_METHOD
+
+DEFAULT_FETCH_WORKERS = 8
 
 REPORTREE_SAFE_COLUMNS = [
     "sample",
@@ -27,30 +33,104 @@ def normalise_missing(value):
     return value
 
 
+def typing_alleles(details, typing_method):
+    """Return the allele calls of a typing method from sample details, if any."""
+    for result in details.get("typing_result", []):
+        if (result.get("type") or "").lower() == typing_method:
+            return (result.get("result") or {}).get("alleles") or {}
+    return None
+
+
+def fetch_sample_details_concurrently(
+    client, sample_ids, workers=DEFAULT_FETCH_WORKERS, cache=None, catalogue=None
+):
+    """
+    Fetch sample details using a bounded pool of worker threads.
+    Yields (sample_id, details) pairs in the order of sample_ids. Details are None
+    for samples that could not be fetched, so one failure does not abort the rest.
+
+    If a SampleDetailCache is given, samples whose catalogue entry is unchanged
+    are served from the cache and only the remaining samples are fetched.
+    Details are reduced to the fields used by the pipeline either way.
+    """
+
+    def fetch(sample_id):
+        try:
+            return slim_sample_details(fetch_sample_details(client, sample_id))
+        except Exception as e:
+            print(f"Error fetching details for sample {sample_id}: {e}")
+            return None
+
+    def fetch_all(ids):
+        if workers <= 1:
+            for sample_id in ids:
+                yield sample_id, fetch(sample_id)
+            return
+
+        # executor.map consumes its input up front, so a generator of IDs must
+        # be materialised to be zipped with the results.
+        ids = list(ids)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from zip(ids, executor.map(fetch, ids))
+
+    if cache is None:
+        yield from fetch_all(sample_ids)
+        return
+
+    sample_ids = list(sample_ids)
+    fingerprints = {
+        sample_id: sample_fingerprint(catalogue.get(sample_id) if catalogue else None)
+        for sample_id in sample_ids
+    }
+    cached = cache.get_many(fingerprints)
+    fetched = fetch_all([s for s in sample_ids if s not in cached])
+
+    for sample_id in sample_ids:
+        if sample_id in cached:
+            yield sample_id, cached[sample_id]
+            continue
+
+        _, details = next(fetched)
+        if details is not None:
+            cache.put(sample_id, fingerprints[sample_id], details)
+        yield sample_id, details
+
+
 def process_samples_by_profile(
-    bonsai_api_url,
-    token,
+    client,
+    catalogue,
     output_folder,
     target_profiles=None,
     user_selected_profiles=None,
+    sample_ids=None,
+    fetch_workers=DEFAULT_FETCH_WORKERS,
+    cache=None,
+    allele_profiles=None,
 ):
     """
     Process samples grouped by their profiles, filtering based on target_profiles.
+    If sample_ids is given, only those samples are fetched and processed.
+    Sample details are read through the SampleDetailCache when one is given.
+
+    If an allele_profiles dict is given and complete profiles are processed
+    (no sample_ids), it receives the similarity typing alleles of each profile,
+    so local similarity can reuse them instead of fetching the samples again.
     """
     os.makedirs(output_folder, exist_ok=True)
 
-    samples = fetch_samples(bonsai_api_url, token)
+    requested_ids = sample_ids
     profiles = {}
 
-    for sample in samples:
-        profile = sample.get("profile")
-        sample_id = sample.get("sample_id")
-
-        if not sample_id or not profile:
+    for profile in catalogue.profiles():
+        if target_profiles is not None and profile not in target_profiles:
             continue
 
-        if target_profiles is None or profile in target_profiles:
-            profiles.setdefault(profile, []).append(sample_id)
+        profile_ids = catalogue.profile_ids(profile)
+        if sample_ids is not None:
+            profile_ids = [s for s in profile_ids if s in sample_ids]
+
+        if profile_ids:
+            profiles[profile] = profile_ids
 
     if not profiles:
         print("No samples match the specified profiles. Exiting.")
@@ -63,10 +143,20 @@ def process_samples_by_profile(
         print(f"\nProcessing profile: {profile} with {len(sample_ids)} samples")
 
         metadata_rows = []
-        cgmlst_frames = []
-
-        for sample_id in sample_ids:
-            sample_data = fetch_sample_details(bonsai_api_url, token, sample_id)
+        cgmlst_matrix = CgmlstMatrix()
+        similarity_matrix = CgmlstMatrix()
+        failed_ids = []
+
+        for sample_id, sample_data in fetch_sample_details_concurrently(
+            client,
+            sample_ids,
+            workers=fetch_workers,
+            cache=cache,
+            catalogue=catalogue,
+        ):
+            if sample_data is None:
+                failed_ids.append(sample_id)
+                continue
 
             sequencing_date = sample_data.get("sequencing_date")
 
@@ -132,14 +222,31 @@ def process_samples_by_profile(
             )
 
             if cgmlst:
-                allele_row = {"sample": sample_id}
-                allele_row.update(cgmlst.get("result", {}).get("alleles", {}))
-                cgmlst_frames.append(pd.DataFrame([allele_row]))
+                cgmlst_matrix.add(
+                    sample_id, cgmlst.get("result", {}).get("alleles", {})
+                )
             else:
                 print(f"No cgMLST data found for sample {sample_id}")
 
+            similarity_alleles = typing_alleles(sample_data, SIMILARITY_TYPING_METHOD)
+            if similarity_alleles:
+                similarity_matrix.add(sample_id, similarity_alleles)
+
             metadata_rows.append(metadata_row)
 
+        if failed_ids:
+            print(
+                f"Skipped {len(failed_ids)} sample(s) in profile {profile} "
+                f"that could not be fetched: {', '.join(failed_ids)}"
+            )
+
+        if allele_profiles is not None and requested_ids is None:
+            allele_profiles[profile] = similarity_matrix
+
+        if not metadata_rows:
+            print(f"No sample details could be fetched for profile {profile}")
+            continue
+
         metadata_df = pd.DataFrame(metadata_rows)
 
         full_metadata_file = os.path.join(
@@ -169,29 +276,12 @@ def process_samples_by_profile(
             }
         )
 
-        if cgmlst_frames:
-            cgmlst_df = pd.concat(cgmlst_frames, ignore_index=True)
-            missing_codes = {
-                "ASM",
-                "EXC",
-                "INF",
-                "LNF",
-                "PLNF",
-                "PLOT3",
-                "PLOT5",
-                "LOTSC",
-                "NIPH",
-                "NIPHEM",
-                "PAMA",
-                "ALM",
-            }
-            cgmlst_df.replace(missing_codes, "0", inplace=True)
-
+        if len(cgmlst_matrix):
             cgmlst_file = os.path.join(
                 output_folder,
                 f"cgmlst_{profile}.tsv",
             )
-            cgmlst_df.to_csv(cgmlst_file, sep="\t", index=False)
+            cgmlst_matrix.write_tsv(cgmlst_file)
             cgmlst_files.append(cgmlst_file)
         else:
             print(f"No cgMLST data collected for profile {profile}")
@@ -1,60 +1,145 @@
 #!/usr/bin/env python3
 import time
 import datetime
-import requests
-import json
 import os
+import random
+from collections import deque
 
+from artefacts import write_jsonl
 
-def submit_similarity_job(bonsai_api_url, token, sample_id):
-    url = f"{bonsai_api_url}/samples/{sample_id}/similar"
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-    }
+DEFAULT_SIMILARITY_WORKERS = 20
+DEFAULT_POLL_INTERVAL = 1
+DEFAULT_MAX_POLL_INTERVAL = 20
+DEFAULT_JOB_TIMEOUT = 300
+
+SIMILARITY_LIMIT = 10
+SIMILARITY_THRESHOLD = 0.5
+SIMILARITY_TYPING_METHOD = "mlst"
+
+
+def submit_similarity_job(client, sample_id):
     data = {
-        "limit": 10,
-        "similarity": 0.5,
+        "limit": SIMILARITY_LIMIT,
+        "similarity": SIMILARITY_THRESHOLD,
         "cluster": False,
-        "typing_method": "mlst",
+        "typing_method": SIMILARITY_TYPING_METHOD,
         "cluster_method": "single",
     }
 
-    response = requests.post(url, headers=headers, json=data)
-    response.raise_for_status()
+    response = client.post(f"/samples/{sample_id}/similar", json=data)
     return response.json().get("id")
 
 
-def get_job_status(bonsai_api_url, token, job_id):
-    url = f"{bonsai_api_url}/job/status/{job_id}"
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {token}",
-    }
-
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
+def get_job_status(client, job_id):
+    response = client.get(f"/job/status/{job_id}")
     return response.json()
 
 
+def extract_similar(sample, job_status):
+    """Build the deduplicated list of similar samples from a finished job."""
+    similar_list = []
+    seen_similar_ids = set()
+
+    results = job_status.get("result") if job_status else None
+
+    if results:
+        for entry in results:
+            similar_id = entry.get("sample_id")
+
+            if not similar_id:
+                continue
+
+            if similar_id == sample:
+                continue
+
+            if similar_id in seen_similar_ids:
+                continue
+
+            seen_similar_ids.add(similar_id)
+
+            similar_list.append(
+                {
+                    "ID": similar_id,
+                    "similarity": entry.get("similarity"),
+                }
+            )
+
+    return similar_list
+
+
+def similar_sort_key(entry):
+    """Order similar entries by similarity (highest first), then by ID."""
+    return -(entry.get("similarity") or 0), str(entry.get("ID"))
+
+
+def merge_similar(existing, additions, limit=SIMILARITY_LIMIT):
+    """
+    Merge newly found similar samples into a stored similar list.
+    Entries for the added IDs replace any stored ones, and the result is cut
+    back to the top limit entries by similarity, with ties ordered by ID.
+    """
+    added_ids = {entry["ID"] for entry in additions}
+    merged = [entry for entry in existing if entry.get("ID") not in added_ids]
+    merged.extend(additions)
+    merged.sort(key=similar_sort_key)
+    return merged[:limit]
+
+
+def invert_neighbours(neighbours, exclude_ids=()):
+    """
+    Turn {new_id: [similar entries]} into {existing_id: [entries for new IDs]}.
+    Similarity is symmetric, so a new sample's neighbour gains it as a neighbour.
+    """
+    exclude_ids = set(exclude_ids)
+    inverted = {}
+
+    for sample_id, similar_list in neighbours.items():
+        for entry in similar_list:
+            neighbour_id = entry.get("ID")
+            if not neighbour_id or neighbour_id in exclude_ids:
+                continue
+            inverted.setdefault(neighbour_id, []).append(
+                {"ID": sample_id, "similarity": entry.get("similarity")}
+            )
+
+    return inverted
+
+
+def next_poll_delay(interval, max_interval=DEFAULT_MAX_POLL_INTERVAL):
+    """Double the poll interval up to max_interval and add up to 20% jitter."""
+    delay = min(interval * 2, max_interval)
+    return delay, delay * random.uniform(1.0, 1.2)
+
+
 def process_similarity(
-    bonsai_api_url,
-    token,
+    client,
     sample_ids,
     output_dir,
     profile,
-    poll_interval=3,
-    max_attempts=10,
+    poll_interval=DEFAULT_POLL_INTERVAL,
+    max_poll_interval=DEFAULT_MAX_POLL_INTERVAL,
+    job_timeout=DEFAULT_JOB_TIMEOUT,
+    max_requeues=1,
+    max_in_flight=DEFAULT_SIMILARITY_WORKERS,
     save_files=False,
     progress_callback=None,
+    report=None,
 ):
     """
-    Submit similarity jobs for a list of samples
+    Submit similarity jobs for a list of samples.
+
+    Up to max_in_flight jobs are outstanding at any time and all of them are
+    polled in a single loop, so waiting on Bonsai workers overlaps across
+    samples. Each job is polled with exponential backoff starting at
+    poll_interval. A job that has not finished within job_timeout seconds is
+    re-submitted at the end of the batch, up to max_requeues times. Samples whose
+    jobs fail, are cancelled or still time out are reported and left out of the
+    results, so their stored similarity is not overwritten with an empty list.
+
+    Results are returned in the order of sample_ids. If a report dict is given,
+    the number of failed and timed-out samples is written to it.
     """
 
-    similarity = []
-
     seen_samples = set()
     unique_sample_ids = []
     for sample_id in sample_ids:
@@ -62,71 +147,101 @@ def process_similarity(
             seen_samples.add(sample_id)
             unique_sample_ids.append(sample_id)
 
-    for sample in unique_sample_ids:
-        if progress_callback:
-            progress_callback()
-        else:
-            print(f"\nSubmitting similarity job for sample: {sample}")
-
-        try:
-            job_id = submit_similarity_job(bonsai_api_url, token, sample)
-
-            job_status = None
-            for _ in range(max_attempts):
-                job_status = get_job_status(bonsai_api_url, token, job_id)
-                if job_status.get("status") in ("completed", "finished"):
-                    break
-                time.sleep(poll_interval)
-
-            similar_list = []
-            seen_similar_ids = set()
-
-            results = job_status.get("result") if job_status else None
-
-            if results:
-                for entry in results:
-                    similar_id = entry.get("sample_id")
-
-                    if not similar_id:
-                        continue
-
-                    if similar_id == sample:
-                        continue
-
-                    if similar_id in seen_similar_ids:
-                        continue
-
-                    seen_similar_ids.add(similar_id)
-
-                    similar_list.append(
-                        {
-                            "ID": similar_id,
-                            "similarity": entry.get("similarity"),
-                        }
-                    )
-
-            similarity.append(
-                {
-                    "ID": sample,
-                    "similar": similar_list,
-                    "createdAt": datetime.datetime.utcnow().isoformat(),
-                }
-            )
-
-        except Exception as e:
-            print(f"Error processing sample {sample}: {e}")
-            similarity.append(
-                {
-                    "ID": sample,
-                    "similar": [],
-                    "createdAt": datetime.datetime.utcnow().isoformat(),
-                }
-            )
+    results = {}
+    failed = set()
+    timed_out = set()
+    requeues = {}
+    queue = deque(unique_sample_ids)
+    in_flight = {}
+
+    def record(sample, similar_list):
+        results[sample] = {
+            "ID": sample,
+            "similar": similar_list,
+            "createdAt": datetime.datetime.utcnow().isoformat(),
+        }
+
+    def fail(sample, error):
+        print(f"Error processing sample {sample}: {error}")
+        failed.add(sample)
+
+    while queue or in_flight:
+        while queue and len(in_flight) < max_in_flight:
+            sample = queue.popleft()
+
+            if sample not in requeues:
+                if progress_callback:
+                    progress_callback()
+                else:
+                    print(f"\nSubmitting similarity job for sample: {sample}")
+
+            try:
+                job_id = submit_similarity_job(client, sample)
+            except Exception as e:
+                fail(sample, e)
+                continue
+
+            now = time.monotonic()
+            in_flight[sample] = {
+                "job_id": job_id,
+                "interval": poll_interval,
+                "next_poll": now + poll_interval,
+                "deadline": now + job_timeout,
+            }
+
+        now = time.monotonic()
+
+        for sample, job in list(in_flight.items()):
+            if job["next_poll"] > now:
+                continue
+
+            try:
+                job_status = get_job_status(client, job["job_id"])
+            except Exception as e:
+                del in_flight[sample]
+                fail(sample, e)
+                continue
+
+            status = job_status.get("status")
+
+            if status in ("completed", "finished"):
+                del in_flight[sample]
+                record(sample, extract_similar(sample, job_status))
+            elif status in ("failed", "canceled", "stopped"):
+                del in_flight[sample]
+                fail(sample, f"similarity job {status}")
+            elif now >= job["deadline"]:
+                del in_flight[sample]
+                if requeues.get(sample, 0) < max_requeues:
+                    requeues[sample] = requeues.get(sample, 0) + 1
+                    queue.append(sample)
+                else:
+                    print(f"Similarity job for sample {sample} timed out")
+                    timed_out.add(sample)
+            else:
+                job["interval"], delay = next_poll_delay(
+                    job["interval"], max_poll_interval
+                )
+                job["next_poll"] = min(now + delay, job["deadline"])
+
+        if in_flight:
+            next_poll = min(job["next_poll"] for job in in_flight.values())
+            time.sleep(max(0.0, next_poll - time.monotonic()))
+
+    similarity = [results[sample] for sample in unique_sample_ids if sample in results]
+
+    print(
+        f"Similarity: {len(similarity)} completed, {len(failed)} failed, "
+        f"{len(timed_out)} timed out"
+    )
+
+    if report is not None:
+        report["failed"] = len(failed)
+        report["timed_out"] = len(timed_out)
 
     if save_files:
         os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, f"{profile}_similarity.json")
-        with open(output_path, "w", encoding="utf-8") as outfile:
-            json.dump(similarity, outfile, indent=2)
+        output_path = os.path.join(output_dir, f"{profile}_similarity.jsonl")
+        write_jsonl(output_path, similarity)
 
     return similarity
@@ -1,120 +1,136 @@
 #!/usr/bin/env python3
+import os
 import csv
 import json
 import datetime
-
-
-def process_tsv(
-    metadata_partitions_tsv,
-    full_metadata_file,
-    features_json_path=None,
-    save_files=False,
-):
+import numpy as np
+
+from artefacts import write_jsonl
+
+BASE_FIELDS = {
+    "PostCode",
+    "Hospital",
+    "Profile",
+    "Pipeline_Version",
+    "Pipeline_Date",
+    "Date",
+    "sample",
+    "QC_Status",
+    "ST",
+    "Time",
+    "lims_id",
+}
+
+
+def read_partition_samples(metadata_partitions_tsv):
     """
-    Process the _metadata_w_partitions.tsv file produced by ReporTree and generate
-    JSON outputs compatible with the Mongoose Feature schema.
-
-    ReporTree runs on a restricted metadata file. All metadata fields are restored
-    from the full metadata file before upload.
+    Read only the sample column of ReporTree's _metadata_w_partitions.tsv.
+    Returns the sample IDs in file order, each listed once.
     """
-
-    features = []
-    metadata_lookup = {}
+    with open(metadata_partitions_tsv, newline="", encoding="utf-8") as tsvfile:
+        reader = csv.reader(tsvfile, delimiter="\t")
+        header = next(reader, [])
+        if "sample" not in header:
+            return []
+
+        sample_index = header.index("sample")
+        return list(
+            dict.fromkeys(
+                row[sample_index].strip()
+                for row in reader
+                if len(row) > sample_index and row[sample_index].strip()
+            )
+        )
+
+
+def read_feature_properties(full_metadata_file, sample_ids):
+    """
+    Read feature properties for the given samples from the full metadata file,
+    one row at a time and only keeping the rows of those samples.
+    Returns {sample_id: properties}; a sample listed twice keeps its last row.
+    """
+    sample_ids = set(sample_ids)
+    properties_by_id = {}
 
     with open(full_metadata_file, newline="", encoding="utf-8") as full_file:
-        full_reader = csv.DictReader(full_file, delimiter="\t")
-        full_fields = full_reader.fieldnames or []
-
-        base_fields = {
-            "PostCode",
-            "Hospital",
-            "Profile",
-            "Pipeline_Version",
-            "Pipeline_Date",
-            "Date",
-            "sample",
-            "QC_Status",
-            "ST",
-            "Time",
-            "lims_id",
-        }
+        reader = csv.reader(full_file, delimiter="\t")
+        fields = next(reader, [])
+        index = {field: i for i, field in enumerate(fields)}
 
-        allele_fields = set(full_fields) - base_fields
+        allele_columns = [
+            (i, field) for i, field in enumerate(fields) if field not in BASE_FIELDS
+        ]
 
-        for row in full_reader:
-            sample_id = row.get("sample", "").strip()
-            if not sample_id:
-                continue
+        def column(row, field):
+            i = index.get(field)
+            return row[i].strip() if i is not None and i < len(row) else ""
 
-            typing = {
-                "ST": row.get("ST", "").strip(),
-                "alleles": {},
-            }
+        for row in reader:
+            sample_id = column(row, "sample")
+            if not sample_id or sample_id not in sample_ids:
+                continue
 
-            for field in allele_fields:
-                value = row.get(field, "").strip()
+            alleles = {}
+            for i, field in allele_columns:
+                value = row[i].strip() if i < len(row) else ""
                 if value:
-                    typing["alleles"][field] = value
-
-            metadata_lookup[sample_id] = {
-                "PostCode": row.get("PostCode", "").strip(),
-                "Hospital": row.get("Hospital", "").strip(),
-                "analysis_profile": row.get("Profile", "").strip(),
-                "Pipeline_Version": row.get("Pipeline_Version", "").strip(),
-                "Pipeline_Date": row.get("Pipeline_Date", "").strip(),
-                "Date": row.get("Date", "").strip(),
-                "QC_Status": row.get("QC_Status", "").strip(),
-                "typing": typing,
+                    alleles[field] = value
+
+            properties = {
+                "PostCode": column(row, "PostCode"),
+                "Hospital": column(row, "Hospital"),
+                "analysis_profile": column(row, "Profile"),
+                "Pipeline_Version": column(row, "Pipeline_Version"),
+                "Pipeline_Date": column(row, "Pipeline_Date"),
+                "Date": column(row, "Date"),
+                "ID": sample_id,
+                "QC_Status": column(row, "QC_Status"),
             }
 
-    try:
-        with open(metadata_partitions_tsv, newline="", encoding="utf-8") as tsvfile:
-            reader = csv.DictReader(tsvfile, delimiter="\t")
-
-            for row in reader:
-                sample_id = row.get("sample", "").strip()
-                if not sample_id:
-                    continue
-
-                if sample_id not in metadata_lookup:
-                    continue
+            typing = {"ST": column(row, "ST"), "alleles": alleles}
+            if typing["ST"] or alleles:
+                properties["typing"] = typing
 
-                full_meta = metadata_lookup[sample_id]
+            properties_by_id[sample_id] = properties
 
-                properties = {
-                    "PostCode": full_meta["PostCode"],
-                    "Hospital": full_meta["Hospital"],
-                    "analysis_profile": full_meta["analysis_profile"],
-                    "Pipeline_Version": full_meta["Pipeline_Version"],
-                    "Pipeline_Date": full_meta["Pipeline_Date"],
-                    "Date": full_meta["Date"],
-                    "ID": sample_id,
-                    "QC_Status": full_meta["QC_Status"],
-                }
+    return properties_by_id
 
-                typing = full_meta.get("typing", {})
-                if typing.get("ST") or typing.get("alleles"):
-                    properties["typing"] = typing
 
-                features.append(
-                    {
-                        "type": "Feature",
-                        "properties": properties,
-                        "geometry": {
-                            "type": "Point",
-                            "coordinates": [],
-                        },
-                    }
-                )
+def process_tsv(
+    metadata_partitions_tsv,
+    full_metadata_file,
+    features_json_path=None,
+    save_files=False,
+):
+    """
+    Process the _metadata_w_partitions.tsv file produced by ReporTree and generate
+    features compatible with the Mongoose Feature schema, in the order of the
+    partitions file and once per sample, saved as JSON Lines if save_files is set.
 
-        print("Successfully processed results")
+    ReporTree runs on a restricted metadata file. All metadata fields are restored
+    from the full metadata file before upload. Errors reading either file are
+    raised, so the stage processing the features fails rather than the upload.
+    """
+    sample_ids = read_partition_samples(metadata_partitions_tsv)
+    properties_by_id = read_feature_properties(full_metadata_file, sample_ids)
+
+    features = [
+        {
+            "type": "Feature",
+            "properties": properties_by_id[sample_id],
+            "geometry": {
+                "type": "Point",
+                "coordinates": [],
+            },
+        }
+        for sample_id in sample_ids
+        if sample_id in properties_by_id
+    ]
 
-        if save_files and features_json_path:
-            with open(features_json_path, "w", encoding="utf-8") as jsonfile:
-                json.dump(features, jsonfile, indent=2, ensure_ascii=False)
+    print("Successfully processed results")
 
-    except Exception as e:
-        print(f"Error processing results: {e}")
+    if save_files and features_json_path:
+        write_jsonl(features_json_path, features)
 
     return features
 
@@ -169,16 +185,73 @@ def process_cluster_composition(
     return clustering_result
 
 
-def parse_distance_tsv(tsv_path):
+def _read_distance_header(f):
+    header = f.readline().rstrip("\n").split("\t")
+    return header[1:]
+
+
+def parse_distance_tsv(tsv_path, cache=False):
     """
     Parse the *_dist_hamming.tsv file produced by ReporTree.
+
+    Rows are streamed into a preallocated uint16 array (widened to uint32 if a
+    distance does not fit), and the matrix is checked to be square and
+    symmetric. With cache=True, the array is saved next to the TSV as .npy and
+    later calls memory-map it while it is newer than the TSV.
+    Returns (samples, matrix).
     """
+    cache_path = tsv_path + ".npy"
+
+    with open(tsv_path, "r", encoding="utf-8") as f:
+        samples = _read_distance_header(f)
+        n = len(samples)
+
+        if (
+            cache
+            and os.path.exists(cache_path)
+            and os.path.getmtime(cache_path) >= os.path.getmtime(tsv_path)
+        ):
+            matrix = np.load(cache_path, mmap_mode="r")
+            if matrix.shape == (n, n):
+                return samples, matrix
+
+        matrix = np.zeros((n, n), dtype=np.uint16)
+        row_count = 0
+
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
 
-    with open(tsv_path, "r") as f:
-        lines = [line.strip().split("\t") for line in f.readlines()]
+            sample_id, _, values = line.partition("\t")
+            if row_count >= n or sample_id != samples[row_count]:
+                raise ValueError(
+                    f"Unexpected row {sample_id!r} in distance matrix {tsv_path}"
+                )
 
-    samples = lines[0][1:]
-    matrix = [[int(x) for x in row[1:]] for row in lines[1:]]
+            row = np.array(values.split("\t"), dtype=np.int64)
+            if row.size != n:
+                raise ValueError(
+                    f"Row {sample_id!r} has {row.size} values, expected {n}"
+                )
+            if row.size and row.min() < 0:
+                raise ValueError(f"Negative distance in row {sample_id!r}")
+            if row.size and row.max() > np.iinfo(matrix.dtype).max:
+                matrix = matrix.astype(np.uint32)
+
+            matrix[row_count] = row
+            row_count += 1
+
+    if row_count != n:
+        raise ValueError(
+            f"Distance matrix {tsv_path} has {row_count} rows for {n} samples"
+        )
+    if not np.array_equal(matrix, matrix.T):
+        raise ValueError(f"Distance matrix {tsv_path} is not symmetric")
+
+    if cache:
+        np.save(cache_path, matrix)
+        matrix = np.load(cache_path, mmap_mode="r")
 
     return samples, matrix
 
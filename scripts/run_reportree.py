@@ -1,50 +1,238 @@
 #!/usr/bin/env python3
 import os
+import re
 import shutil
+import tempfile
 import subprocess
 
+REPORTREE_IMAGE = "insapathogenomics/reportree:v2.5.4"
+REPORTREE_CONTAINER = os.getenv("REPORTREE_CONTAINER", "mimosa-reportree")
+REPORTREE_SHARED_DIR = os.getenv("REPORTREE_SHARED_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "volumes",
+    "reportree",
+)
+REPORTREE_BIN = os.getenv("REPORTREE_BIN", "reportree.py")
+REPORTREE_BACKENDS = ["auto", "exec", "run", "local"]
 
-def run_reportree(
-    metadata_file, cgmlst_file, output_folder, analysis_profile, save_files=False
-):
+# Docker's smallest accepted limits; a zero limit would mean unlimited.
+MIN_REPORTREE_CPUS = 0.01
+MIN_REPORTREE_MEMORY_MB = 6
+
+MEMORY_UNITS = {"": 1, "b": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+
+
+def parse_memory(value):
+    """Parse a docker-style memory size (e.g. 512m, 8g) into bytes."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([bkmg]?)b?\s*", str(value).lower())
+    if not match:
+        raise ValueError(f"Invalid memory size: {value!r}")
+    number, unit = match.groups()
+    return int(float(number) * MEMORY_UNITS[unit])
+
+
+def reportree_resource_limits(cpus=None, memory=None, concurrent_runs=1):
     """
-    ReporTree.
+    Split a CPU and memory budget evenly over concurrent ReporTree runs.
+    Returns keyword arguments for run_reportree; no limit is set for a budget
+    that is not given. Each run gets at least Docker's minimum limits, so a
+    small budget split over many runs never rounds down to unlimited.
     """
-    os.makedirs(output_folder, exist_ok=True)
+    runs = max(1, concurrent_runs)
+    limits = {}
 
-    metadata_basename = os.path.basename(metadata_file)
-    cgmlst_basename = os.path.basename(cgmlst_file)
+    if cpus:
+        limits["cpus"] = max(round(cpus / runs, 2), MIN_REPORTREE_CPUS)
+    if memory:
+        memory_mb = max(
+            parse_memory(memory) // runs // 1024**2, MIN_REPORTREE_MEMORY_MB
+        )
+        limits["memory"] = f"{memory_mb}m"
 
-    local_metadata = os.path.join(output_folder, metadata_basename)
-    local_cgmlst = os.path.join(output_folder, cgmlst_basename)
+    return limits
 
-    if os.path.abspath(metadata_file) != os.path.abspath(local_metadata):
-        shutil.copy2(metadata_file, local_metadata)
-    if os.path.abspath(cgmlst_file) != os.path.abspath(local_cgmlst):
-        shutil.copy2(cgmlst_file, local_cgmlst)
 
+def reportree_arguments(metadata, cgmlst, out):
+    """ReporTree command-line arguments used by every backend."""
     thr = 9
     method = "MSTreeV2"
     analysis = "grapetree"
 
-    docker_command = [
+    return [
+        "-m",
+        metadata,
+        "-a",
+        cgmlst,
+        "-out",
+        out,
+        "--analysis",
+        analysis,
+        "--method",
+        method,
+        "-thr",
+        str(thr),
+    ]
+
+
+def reportree_container_running(container=REPORTREE_CONTAINER):
+    """Whether the long-running ReporTree service container is up."""
+    try:
+        result = subprocess.run(
+            ["docker", "inspect", "-f", "{{.State.Running}}", container],
+            capture_output=True,
+            text=True,
+        )
+    except FileNotFoundError:
+        return False
+    return result.returncode == 0 and result.stdout.strip() == "true"
+
+
+def resolve_reportree_backend(backend="auto"):
+    """
+    Resolve the ReporTree backend. "auto" uses the running service container
+    through docker exec and falls back to a new docker run container.
+    """
+    if backend == "auto":
+        return "exec" if reportree_container_running() else "run"
+
+    if backend == "exec" and not reportree_container_running():
+        raise RuntimeError(
+            f"ReporTree container '{REPORTREE_CONTAINER}' is not running. "
+            "Start it with `docker compose up -d reportree`."
+        )
+    if backend == "local" and not shutil.which(REPORTREE_BIN):
+        raise RuntimeError(f"ReporTree executable '{REPORTREE_BIN}' not found.")
+
+    return backend
+
+
+def _docker_run_command(output_folder, inputs, analysis_profile, cpus, memory):
+    resource_flags = []
+    if cpus:
+        resource_flags += ["--cpus", str(cpus)]
+    if memory:
+        resource_flags += ["--memory", str(memory)]
+
+    metadata, cgmlst = (f"/data/{name}" for name in inputs)
+    arguments = " ".join(
+        reportree_arguments(metadata, cgmlst, f"/data/{analysis_profile}")
+    )
+
+    return [
         "docker",
         "run",
         "--rm",
+        *resource_flags,
         "-v",
         f"{os.path.abspath(output_folder)}:/data",
-        "insapathogenomics/reportree:v2.5.4",
+        REPORTREE_IMAGE,
         "bash",
         "-c",
-        f"mkdir -p /data && reportree.py "
-        f"-m /data/{metadata_basename} "
-        f"-a /data/{cgmlst_basename} "
-        f"-out /data/{analysis_profile} "
-        f"--analysis {analysis} --method {method} -thr {thr}",
+        f"mkdir -p /data && reportree.py {arguments}",
     ]
 
-    print(f"Running ReporTree for {analysis_profile}…")
-    result = subprocess.run(docker_command, capture_output=True, text=True)
+
+def _run_exec(output_folder, inputs, analysis_profile):
+    """
+    Run ReporTree in the service container. Inputs are staged in a job folder
+    on the volume shared with the container, and results are copied back.
+    """
+    os.makedirs(REPORTREE_SHARED_DIR, exist_ok=True)
+    job_dir = tempfile.mkdtemp(prefix=f"{analysis_profile}_", dir=REPORTREE_SHARED_DIR)
+    container_dir = f"/data/{os.path.basename(job_dir)}"
+
+    try:
+        for name in inputs:
+            shutil.copy2(os.path.join(output_folder, name), job_dir)
+        os.chmod(job_dir, 0o777)
+
+        metadata, cgmlst = (f"{container_dir}/{name}" for name in inputs)
+        command = [
+            "docker",
+            "exec",
+            REPORTREE_CONTAINER,
+            "reportree.py",
+            *reportree_arguments(
+                metadata, cgmlst, f"{container_dir}/{analysis_profile}"
+            ),
+        ]
+        result = subprocess.run(command, capture_output=True, text=True)
+
+        for name in os.listdir(job_dir):
+            if name in inputs:
+                continue
+            source = os.path.join(job_dir, name)
+            target = os.path.join(output_folder, name)
+            if os.path.isdir(source):
+                shutil.copytree(source, target, dirs_exist_ok=True)
+            else:
+                shutil.copy2(source, target)
+
+        return result
+    finally:
+        # Results are written by the container user, so remove them from
+        # inside the container before removing the job folder.
+        subprocess.run(
+            ["docker", "exec", REPORTREE_CONTAINER, "rm", "-rf", container_dir],
+            capture_output=True,
+        )
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def run_reportree(
+    metadata_file,
+    cgmlst_file,
+    output_folder,
+    analysis_profile,
+    save_files=False,
+    cpus=None,
+    memory=None,
+    backend="run",
+):
+    """
+    ReporTree.
+
+    backend selects how ReporTree is executed: "exec" in the running service
+    container, "run" in a new container, or "local" with a ReporTree executable
+    on this host. It is used as given; resolve_reportree_backend checks it once
+    per pipeline run, and is only called here for "auto". cpus and memory limit
+    the container of the run backend (docker --cpus/--memory).
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    if backend == "auto":
+        backend = resolve_reportree_backend(backend)
+
+    metadata_basename = os.path.basename(metadata_file)
+    cgmlst_basename = os.path.basename(cgmlst_file)
+    inputs = (metadata_basename, cgmlst_basename)
+
+    local_metadata = os.path.join(output_folder, metadata_basename)
+    local_cgmlst = os.path.join(output_folder, cgmlst_basename)
+
+    if os.path.abspath(metadata_file) != os.path.abspath(local_metadata):
+        shutil.copy2(metadata_file, local_metadata)
+    if os.path.abspath(cgmlst_file) != os.path.abspath(local_cgmlst):
+        shutil.copy2(cgmlst_file, local_cgmlst)
+
+    print(f"Running ReporTree for {analysis_profile} ({backend})…")
+
+    if backend == "exec":
+        result = _run_exec(output_folder, inputs, analysis_profile)
+    elif backend == "local":
+        command = [
+            REPORTREE_BIN,
+            *reportree_arguments(
+                local_metadata,
+                local_cgmlst,
+                os.path.join(os.path.abspath(output_folder), analysis_profile),
+            ),
+        ]
+        result = subprocess.run(command, capture_output=True, text=True)
+    else:
+        command = _docker_run_command(
+            output_folder, inputs, analysis_profile, cpus, memory
+        )
+        result = subprocess.run(command, capture_output=True, text=True)
 
     if result.returncode == 0:
         print(f"ReporTree completed for {analysis_profile}")
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import sqlite3
+import threading
+
+DEFAULT_CACHE_DIR = os.getenv("MIMOSA_CACHE_DIR") or os.path.join(
+    os.path.expanduser("~"), ".cache", "mimosa"
+)
+DEFAULT_CACHE_MAX_ENTRIES = 50000
+DEFAULT_CACHE_MAX_AGE_DAYS = 30
+CACHE_SCHEMA_VERSION = 2
+
+TYPING_METHODS = {"mlst", "cgmlst"}
+
+
+def slim_sample_details(data):
+    """
+    Reduce Bonsai sample details to the fields used by the pipeline.
+    The result keeps the shape of the Bonsai response, so cached and freshly
+    fetched samples are processed identically.
+    """
+    pipeline = data.get("pipeline") or {}
+    qc_status = data.get("qc_status") or {}
+
+    typing_result = []
+    for result in data.get("typing_result") or []:
+        if (result.get("type") or "").lower() not in TYPING_METHODS:
+            continue
+
+        typing = result.get("result") or {}
+        typing_result.append(
+            {
+                "type": result.get("type"),
+                "result": {
+                    "sequence_type": typing.get("sequence_type"),
+                    "alleles": typing.get("alleles") or {},
+                },
+            }
+        )
+
+    return {
+        "sample_id": data.get("sample_id"),
+        "lims_id": data.get("lims_id"),
+        "sequencing_date": data.get("sequencing_date"),
+        "pipeline": {
+            "version": pipeline.get("version"),
+            "date": pipeline.get("date"),
+            "analysis_profile": pipeline.get("analysis_profile"),
+        },
+        "qc_status": {"status": qc_status.get("status")},
+        "typing_result": typing_result,
+    }
+
+
+def sample_fingerprint(summary):
+    """
+    Build the part of the cache key that changes when a sample changes in Bonsai,
+    from its catalogue summary.
+
+    Typing results only change when the pipeline is re-run, which is reflected in
+    the pipeline version and date. QC status and the modification timestamp can
+    change without a re-run and are included as well. Returns None when the
+    summary has none of these fields, as such a sample cannot be validated and
+    must always be fetched.
+    """
+    summary = summary or {}
+    pipeline = summary.get("pipeline") or {}
+    qc_status = summary.get("qc_status")
+    if isinstance(qc_status, dict):
+        qc_status = qc_status.get("status")
+
+    fields = [
+        pipeline.get("version"),
+        pipeline.get("date"),
+        qc_status,
+        summary.get("modified_at") or summary.get("updated_at"),
+    ]
+    if all(field is None for field in fields):
+        return None
+
+    return json.dumps(fields)
+
+
+class SampleDetailCache:
+    """
+    SQLite-backed cache of slim Bonsai sample details.
+
+    Entries are keyed by sample_id and store the catalogue fingerprint they were
+    fetched under. An entry is invalidated when the fingerprint changes, when it
+    is older than max_age_days, or when the cache schema version changes.
+    Samples without a fingerprint are never served from or stored in the cache.
+    The cache is bounded to max_entries, evicting the least recently used
+    samples first.
+    """
+
+    def __init__(
+        self,
+        cache_dir=DEFAULT_CACHE_DIR,
+        max_entries=DEFAULT_CACHE_MAX_ENTRIES,
+        max_age_days=DEFAULT_CACHE_MAX_AGE_DAYS,
+        refresh=False,
+    ):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "sample_details.sqlite")
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._init_schema()
+
+    def _init_schema(self):
+        with self._lock, self._conn:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != CACHE_SCHEMA_VERSION:
+                self._conn.execute("DROP TABLE IF EXISTS samples")
+                self._conn.execute(f"PRAGMA user_version = {CACHE_SCHEMA_VERSION}")
+
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS samples (
+                    sample_id TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    record TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS samples_last_used ON samples (last_used)"
+            )
+
+    def get_many(self, fingerprints):
+        """
+        Look up cached details for a {sample_id: fingerprint} mapping.
+        Returns {sample_id: details} for valid entries only; samples without a
+        fingerprint are always misses.
+        """
+        if self.refresh or not fingerprints:
+            self.misses += len(fingerprints)
+            return {}
+
+        now = time.time()
+        found = {}
+        sample_ids = [s for s, fingerprint in fingerprints.items() if fingerprint]
+
+        with self._lock, self._conn:
+            for start in range(0, len(sample_ids), 500):
+                chunk = sample_ids[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    "SELECT sample_id, fingerprint, record, stored_at FROM samples "
+                    f"WHERE sample_id IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+
+                for sample_id, fingerprint, record, stored_at in rows:
+                    if fingerprint != fingerprints[sample_id]:
+                        continue
+                    if self.max_age and now - stored_at > self.max_age:
+                        continue
+                    found[sample_id] = json.loads(record)
+
+            self._conn.executemany(
+                "UPDATE samples SET last_used = ? WHERE sample_id = ?",
+                [(now, sample_id) for sample_id in found],
+            )
+
+        self.hits += len(found)
+        self.misses += len(fingerprints) - len(found)
+        return found
+
+    def put(self, sample_id, fingerprint, details):
+        """
+        Store slim details for a sample, replacing any previous entry.
+        Samples without a fingerprint are not stored.
+        """
+        if not fingerprint:
+            return
+
+        now = time.time()
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO samples "
+                "(sample_id, fingerprint, record, stored_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    sample_id,
+                    fingerprint,
+                    json.dumps(details, separators=(",", ":")),
+                    now,
+                    now,
+                ),
+            )
+
+    def evict(self):
+        """Drop the least recently used entries beyond max_entries."""
+        if not self.max_entries:
+            return 0
+
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM samples WHERE sample_id IN ("
+                "SELECT sample_id FROM samples ORDER BY last_used DESC "
+                "LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            return cursor.rowcount
+
+    def close(self):
+        self.evict()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
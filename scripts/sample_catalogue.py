@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+from api import iter_samples, DEFAULT_PAGE_SIZE
+
+
+class SampleCatalogue:
+    """
+    Run-scoped view of the Bonsai sample catalogue.
+    Fetched once per run and indexed by sample ID and by profile, so that every
+    stage can look samples up without listing the catalogue again.
+    A sample listed more than once (pages shifting while they are fetched
+    concurrently) is only kept the first time it is seen.
+    """
+
+    def __init__(self, samples):
+        self.by_id = {}
+        self.by_profile = {}
+
+        for sample in samples:
+            sample_id = sample.get("sample_id")
+            if not sample_id or sample_id in self.by_id:
+                continue
+
+            self.by_id[sample_id] = sample
+
+            profile = sample.get("profile")
+            if profile:
+                self.by_profile.setdefault(profile, []).append(sample_id)
+
+    @classmethod
+    def fetch(cls, client, page_size=DEFAULT_PAGE_SIZE, workers=1):
+        """Fetch the full catalogue from Bonsai."""
+        return cls(iter_samples(client, page_size=page_size, workers=workers))
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def __contains__(self, sample_id):
+        return sample_id in self.by_id
+
+    def get(self, sample_id):
+        return self.by_id.get(sample_id)
+
+    def profiles(self):
+        return list(self.by_profile)
+
+    def profile_ids(self, profile):
+        """Sample IDs belonging to a profile, in catalogue order."""
+        return list(self.by_profile.get(profile, []))
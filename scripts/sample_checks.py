@@ -1,11 +1,9 @@
 #!/usr/bin/env python3
-def get_new_sample_ids(all_samples, analyzed_ids, profile):
+def get_new_sample_ids(catalogue, analyzed_ids, profile):
     """
-    Extract new sample IDs for a specific profile by comparing Bonsai samples with MIMOSA-uploaded samples.
+    Extract new sample IDs for a specific profile by comparing the Bonsai sample catalogue with MIMOSA-uploaded samples.
     """
-    profile_samples = [s for s in all_samples if s.get("profile") == profile]
-    profile_ids = {s["sample_id"] for s in profile_samples if "sample_id" in s}
-    return profile_ids - analyzed_ids
+    return set(catalogue.profile_ids(profile)) - analyzed_ids
 
 
 def prompt_if_no_new_samples(profile, new_ids):
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+import os
+import datetime
+import numpy as np
+
+from artefacts import write_jsonl
+from cgmlst_matrix import CgmlstMatrix
+from process_samples import (
+    fetch_sample_details_concurrently,
+    typing_alleles,
+    DEFAULT_FETCH_WORKERS,
+)
+from process_similarity import (
+    SIMILARITY_LIMIT,
+    SIMILARITY_THRESHOLD,
+    SIMILARITY_TYPING_METHOD,
+)
+
+BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def load_allele_profiles(
+    client,
+    catalogue,
+    profiles,
+    typing_method=SIMILARITY_TYPING_METHOD,
+    fetch_workers=DEFAULT_FETCH_WORKERS,
+    cache=None,
+    loaded=None,
+):
+    """
+    Build one allele matrix per profile from every catalogue sample in it.
+    Profiles found in loaded (as filled by process_samples_by_profile) are
+    reused; the others are fetched, through the sample details cache when one
+    is given.
+    """
+    matrices = {}
+
+    for profile in profiles:
+        if loaded and profile in loaded:
+            matrices[profile] = loaded[profile]
+            continue
+
+        matrix = CgmlstMatrix()
+
+        for sample_id, details in fetch_sample_details_concurrently(
+            client,
+            catalogue.profile_ids(profile),
+            workers=fetch_workers,
+            cache=cache,
+            catalogue=catalogue,
+        ):
+            alleles = typing_alleles(details, typing_method) if details else None
+            if alleles:
+                matrix.add(sample_id, alleles)
+
+        matrices[profile] = matrix
+
+    return matrices
+
+
+def similarity_block(query, reference):
+    """
+    Pairwise allele similarity between the rows of two allele matrices.
+    Similarity is the fraction of loci with identical alleles among the loci
+    called (non-zero) in both samples. The loci are compared in a single
+    query x reference x loci boolean array, masked in place.
+    """
+    query_called = query != 0
+    reference_called = reference != 0
+
+    shared = query_called.astype(np.float32) @ reference_called.T.astype(np.float32)
+
+    identical = query[:, None, :] == reference[None, :, :]
+    identical &= query_called[:, None, :]
+    identical &= reference_called[None, :, :]
+    identical = identical.sum(axis=2, dtype=np.float32)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(shared > 0, identical / shared, 0.0)
+
+
+def iter_similarity_blocks(matrix, query_rows):
+    """
+    Yield (row_indices, similarity) for blocks of query rows against all rows
+    of the matrix, sized so the boolean comparison array of similarity_block
+    (one byte per query, sample and locus) stays within BLOCK_BYTES.
+    """
+    values = matrix.values
+    n_samples, n_loci = values.shape
+    block_size = max(1, BLOCK_BYTES // max(1, n_samples * n_loci))
+
+    for start in range(0, len(query_rows), block_size):
+        rows = query_rows[start : start + block_size]
+        yield rows, similarity_block(values[rows], values)
+
+
+def top_similar(similarity, row, sample_ids, limit, threshold):
+    """
+    Select the most similar samples for one row, excluding the sample itself.
+    With limit=None, every sample above the threshold is returned.
+
+    sample_ids is an array of the matrix's sample IDs. Samples are ordered by
+    their rounded similarity and then by ID, as merge_similar orders stored
+    lists, so both engines keep the same samples at the cut-off.
+    """
+    candidates = np.flatnonzero(similarity >= threshold)
+    candidates = candidates[candidates != row]
+
+    scores = np.round(similarity[candidates].astype(np.float64), 4)
+    order = np.lexsort((sample_ids[candidates], -scores))[:limit]
+
+    return [
+        {"ID": str(sample_ids[candidates[i]]), "similarity": float(scores[i])}
+        for i in order
+    ]
+
+
+def compute_similarity(
+    matrix,
+    query_ids,
+    limit=SIMILARITY_LIMIT,
+    threshold=SIMILARITY_THRESHOLD,
+    progress_callback=None,
+    neighbours=None,
+):
+    """
+    Compute the top similar samples for each query sample present in the matrix.
+    If a neighbours dict is given, it receives every sample above the threshold
+    for each query sample, not only the top ones.
+    """
+    row_index = {sample_id: i for i, sample_id in enumerate(matrix.samples)}
+    query_rows = [row_index[s] for s in query_ids if s in row_index]
+    sample_ids = np.asarray(matrix.samples, dtype=str)
+
+    similar = {}
+
+    for rows, block in iter_similarity_blocks(matrix, query_rows):
+        for row, similarity in zip(rows, block):
+            sample_id = matrix.samples[row]
+            similar[sample_id] = top_similar(
+                similarity, row, sample_ids, limit, threshold
+            )
+            if neighbours is not None:
+                neighbours[sample_id] = top_similar(
+                    similarity, row, sample_ids, None, threshold
+                )
+            if progress_callback:
+                progress_callback()
+
+    return similar
+
+
+def process_local_similarity(
+    client,
+    catalogue,
+    sample_ids,
+    output_dir,
+    profile,
+    typing_method=SIMILARITY_TYPING_METHOD,
+    limit=SIMILARITY_LIMIT,
+    threshold=SIMILARITY_THRESHOLD,
+    fetch_workers=DEFAULT_FETCH_WORKERS,
+    cache=None,
+    save_files=False,
+    progress_callback=None,
+    report=None,
+    neighbours=None,
+    allele_profiles=None,
+):
+    """
+    Compute similarity in-process from allele profiles instead of Bonsai jobs.
+
+    Each sample is compared with every sample of its own analysis profile, using
+    the same limit, threshold and typing method as the Bonsai similarity jobs.
+    The output has the same shape as process_similarity; samples without
+    alleles are reported and left out, as failed jobs are. A neighbours dict, if
+    given, is filled as in compute_similarity. Allele matrices already built
+    while processing the profiles can be passed as allele_profiles.
+    """
+
+    unique_sample_ids = list(dict.fromkeys(sample_ids))
+
+    by_profile = {}
+    for sample_id in unique_sample_ids:
+        sample = catalogue.get(sample_id) or {}
+        by_profile.setdefault(sample.get("profile"), []).append(sample_id)
+
+    matrices = load_allele_profiles(
+        client,
+        catalogue,
+        [p for p in by_profile if p],
+        typing_method=typing_method,
+        fetch_workers=fetch_workers,
+        cache=cache,
+        loaded=allele_profiles,
+    )
+
+    similar = {}
+    for sample_profile, query_ids in by_profile.items():
+        matrix = matrices.get(sample_profile)
+        if matrix is None or not len(matrix):
+            continue
+
+        similar.update(
+            compute_similarity(
+                matrix,
+                query_ids,
+                limit=limit,
+                threshold=threshold,
+                progress_callback=progress_callback,
+                neighbours=neighbours,
+            )
+        )
+
+    missing = [s for s in unique_sample_ids if s not in similar]
+    for _ in missing:
+        if progress_callback:
+            progress_callback()
+
+    if missing:
+        print(
+            f"No {typing_method} alleles found for {len(missing)} sample(s): "
+            f"{', '.join(missing)}"
+        )
+
+    created_at = datetime.datetime.utcnow().isoformat()
+    similarity = [
+        {
+            "ID": sample_id,
+            "similar": similar[sample_id],
+            "createdAt": created_at,
+        }
+        for sample_id in unique_sample_ids
+        if sample_id in similar
+    ]
+
+    if report is not None:
+        report["failed"] = len(missing)
+        report["timed_out"] = 0
+
+    if save_files:
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, f"{profile}_similarity.jsonl")
+        write_jsonl(output_path, similarity)
+
+    return similarity
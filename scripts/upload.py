@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 import json
 import os
+import hashlib
 import requests
-from pymongo import MongoClient
+from contextlib import contextmanager
+from itertools import islice
+from bson import ObjectId
+from pymongo import MongoClient, InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv, find_dotenv
-from log_updates import log_sample_event
+from log_updates import SampleLogBuffer
+from artefacts import iter_documents, read_clustering, read_distance
+from distance_store import store_distance
+from clustering_store import store_clustering, DEFAULT_CLUSTERING_RETENTION
+from process_similarity import merge_similar, invert_neighbours, similar_sort_key
 from requests.exceptions import RequestException
 
 dotenv_path = find_dotenv(filename=".env", usecwd=True)
@@ -17,6 +26,10 @@ db_name = os.getenv("MONGO_DB_NAME")
 mimosa_domain = os.getenv("DOMAIN")
 backend_port = os.getenv("BACKEND_PORT")
 
+FEATURE_BATCH_SIZE = 1000
+SIMILARITY_BATCH_SIZE = 1000
+DEFAULT_MONGO_POOL_SIZE = 20
+
 
 def validate_upload_token(token):
     """
@@ -34,220 +47,447 @@ def validate_upload_token(token):
         raise RuntimeError(f"Authentication failed: {e}")
 
 
-def upload_features(data_file_path, overwrite=False, show_log=False, upload_token=None):
-    if not upload_token:
-        raise RuntimeError("upload_token is required for authenticated upload.")
-    uploader_email = validate_upload_token(upload_token)
+class MimosaUploader:
+    """
+    Run-scoped connection to the MIMOSA database for all upload stages.
+    Validates the upload token once, caches the uploader's email and shares a
+    single pooled MongoClient.
+    """
 
-    try:
-        with open(data_file_path, "r", encoding="utf-8") as file:
-            data_to_upload = json.load(file)
-    except Exception as error:
-        print("Error loading data file:", error)
-        return
+    def __init__(self, upload_token, pool_size=DEFAULT_MONGO_POOL_SIZE):
+        if not upload_token:
+            raise RuntimeError("upload_token is required for authenticated upload.")
 
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
-    collection = db["features"]
-
-    updated_count = 0
-    uploaded_count = 0
-
-    def get_changed_fields(existing, new):
-        changed = []
-        old = existing.get("properties", {})
-        new_props = new.get("properties", {})
-        for key in new_props:
-            if key == "typing":
-                old_typing = old.get("typing", {})
-                new_typing = new_props.get("typing", {})
-                if old_typing.get("ST") != new_typing.get("ST"):
-                    changed.append("ST")
-                if "alleles" in new_typing:
-                    old_alleles = old_typing.get("alleles", {})
-                    for allele_key, allele_val in new_typing["alleles"].items():
-                        if old_alleles.get(allele_key) != allele_val:
-                            changed.append(allele_key)
-            else:
-                if old.get(key) != new_props.get(key):
-                    changed.append(key)
-        return changed
-
-    def upload_data(data):
-        nonlocal updated_count, uploaded_count
-        for item in data:
-            sample_id = item["properties"]["ID"]
-            existing = collection.find_one({"properties.ID": sample_id})
-            new_props = item.get("properties", {})
-
-            if existing:
-                old_props = existing.get("properties", {})
-                old_qc = old_props.get("QC_Status")
-                new_qc = new_props.get("QC_Status")
-
-                if old_qc != new_qc:
-                    collection.update_one(
-                        {"_id": existing["_id"]},
-                        {"$set": {"properties.QC_Status": new_qc}},
-                    )
-                    log_sample_event(
-                        db,
-                        sample_id,
-                        new_props.get("analysis_profile"),
-                        changes_dict={"QC_Status": {"old": old_qc, "new": new_qc}},
-                        changed_by="bonsai",
-                    )
+        self.uploader_email = validate_upload_token(upload_token)
+        self.client = MongoClient(mongo_uri, maxPoolSize=pool_size)
+        self.db = self.client[db_name]
 
-                if overwrite:
-                    changed_fields = [
-                        f
-                        for f in get_changed_fields(existing, item)
-                        if f != "QC_Status"
-                    ]
-                    if changed_fields:
-                        collection.update_one(
-                            {"_id": existing["_id"]},
-                            {"$set": {"properties": new_props}},
-                        )
-                        updated_count += 1
-
-                        diff_dict = {}
-                        for field in changed_fields:
-                            if field == "ST":
-                                old_val = old_props.get("typing", {}).get("ST")
-                                new_val = new_props.get("typing", {}).get("ST")
-                            elif field in new_props.get("typing", {}).get(
-                                "alleles", {}
-                            ):
-                                old_val = (
-                                    old_props.get("typing", {})
-                                    .get("alleles", {})
-                                    .get(field)
-                                )
-                                new_val = (
-                                    new_props.get("typing", {})
-                                    .get("alleles", {})
-                                    .get(field)
-                                )
-                            else:
-                                old_val = old_props.get(field)
-                                new_val = new_props.get(field)
+    def collection(self, name):
+        return self.db[name]
 
-                            diff_dict[field] = {"old": old_val, "new": new_val}
+    def close(self):
+        self.client.close()
 
-                        log_sample_event(
-                            db,
-                            sample_id,
-                            new_props.get("analysis_profile"),
-                            changes_dict=diff_dict,
-                            changed_by=uploader_email,
-                        )
-            else:
-                collection.insert_one(item)
-                uploaded_count += 1
-                log_sample_event(
-                    db,
-                    sample_id,
-                    new_props.get("analysis_profile"),
-                    is_insert=True,
-                    changed_by=uploader_email,
-                )
+    def __enter__(self):
+        return self
 
-    try:
-        upload_data(data_to_upload)
-    except Exception as err:
-        print("Error uploading data:", err)
-    finally:
-        client.close()
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
 
-    if overwrite and show_log and updated_count == 0 and uploaded_count == 0:
-        print("No samples were updated or uploaded.")
 
+@contextmanager
+def uploader_scope(uploader=None, upload_token=None):
+    """
+    Yield the given uploader, or a short-lived one for upload_token that is
+    closed afterwards, so upload functions can also be called on their own.
+    """
+    if uploader is not None:
+        yield uploader
+        return
 
-def upload_clustering(data_file_path, upload_token=None):
-    if not upload_token:
-        raise RuntimeError("upload_token is required for authenticated upload.")
-    validate_upload_token(upload_token)
+    with MimosaUploader(upload_token, pool_size=1) as uploader:
+        yield uploader
 
-    try:
-        with open(data_file_path, "r", encoding="utf-8") as file:
-            clustering_data = json.load(file)
-    except Exception as error:
-        print("Error loading clustering data file:", error)
-        return
 
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
-    collection = db["clustering"]
+def properties_hash(properties):
+    """
+    Stable hash of feature properties, used to skip unchanged samples on upload.
+    Keys are sorted and allele calls compared as strings.
+    """
+    typing = properties.get("typing")
+    if isinstance(typing, dict) and isinstance(typing.get("alleles"), dict):
+        alleles = {k: str(v) for k, v in typing["alleles"].items()}
+        properties = {**properties, "typing": {**typing, "alleles": alleles}}
 
-    try:
-        collection.insert_one(clustering_data)
-        print("Clustering result uploaded successfully!")
-    except Exception as err:
-        print("Error uploading clustering data:", err)
-    finally:
-        client.close()
+    canonical = json.dumps(
+        properties, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
 
 
-def upload_distance(data_file_path, upload_token=None):
-    if not upload_token:
-        raise RuntimeError("upload_token is required for authenticated upload.")
-    validate_upload_token(upload_token)
+def load_upload_data(data_file_path=None, data=None, reader=None):
+    """
+    Return data passed in directly, or read it from data_file_path with reader
+    (by default as a single JSON document).
+    """
+    if data is not None:
+        return data
 
-    try:
-        with open(data_file_path, "r", encoding="utf-8") as file:
-            distance_data = json.load(file)
-    except Exception as error:
-        print("Error loading distance data file:", error)
-        return
+    if reader is not None:
+        return reader(data_file_path)
 
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
-    collection = db["distance"]
+    with open(data_file_path, "r", encoding="utf-8") as file:
+        return json.load(file)
 
-    try:
-        collection.update_one(
-            {"analysis_profile": distance_data.get("analysis_profile")},
-            {"$set": distance_data},
-            upsert=True,
-        )
-        print(f"Distance data stored for {distance_data.get('analysis_profile')}")
-    except Exception as err:
-        print("Error uploading distance data:", err)
-    finally:
-        client.close()
 
+def iter_batches(items, size):
+    """Yield lists of up to size items from any iterable."""
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
-def upload_similarity(data_file_path, upload_token=None):
-    if not upload_token:
-        raise RuntimeError("upload_token is required for authenticated upload.")
-    validate_upload_token(upload_token)
 
-    try:
-        with open(data_file_path, "r", encoding="utf-8") as file:
-            similarity_data = json.load(file)
-    except Exception as error:
-        print("Error loading similarity data file:", error)
-        return
+def upload_features(
+    data_file_path=None,
+    overwrite=False,
+    show_log=False,
+    upload_token=None,
+    uploader=None,
+    data=None,
+):
+    """
+    Upload features from data (a list or iterator of feature documents) or,
+    if not given, from data_file_path (JSON Lines, or a legacy JSON array).
+    """
+    with uploader_scope(uploader, upload_token) as uploader:
+        uploader_email = uploader.uploader_email
+
+        try:
+            data_to_upload = load_upload_data(data_file_path, data, iter_documents)
+        except Exception as error:
+            print("Error loading data file:", error)
+            return
+
+        db = uploader.db
+        collection = db["features"]
+
+        log_buffer = SampleLogBuffer(db)
+        updated_count = 0
+        uploaded_count = 0
+
+        def get_changed_fields(existing, new):
+            changed = []
+            old = existing.get("properties", {})
+            new_props = new.get("properties", {})
+            for key in new_props:
+                if key == "typing":
+                    old_typing = old.get("typing", {})
+                    new_typing = new_props.get("typing", {})
+                    if old_typing.get("ST") != new_typing.get("ST"):
+                        changed.append("ST")
+                    if "alleles" in new_typing:
+                        old_alleles = old_typing.get("alleles", {})
+                        for allele_key, allele_val in new_typing["alleles"].items():
+                            if old_alleles.get(allele_key) != allele_val:
+                                changed.append(allele_key)
+                else:
+                    if old.get(key) != new_props.get(key):
+                        changed.append(key)
+            return changed
+
+        def upload_batch(batch):
+            nonlocal updated_count, uploaded_count
+
+            new_hashes = {
+                item["properties"]["ID"]: properties_hash(item.get("properties", {}))
+                for item in batch
+            }
+            stored = {
+                doc["properties"]["ID"]: doc
+                for doc in collection.find(
+                    {"properties.ID": {"$in": list(new_hashes)}},
+                    {"properties.ID": 1, "properties_hash": 1},
+                )
+            }
+
+            # Only samples whose stored hash differs need their properties diffed.
+            changed_ids = [
+                sample_id
+                for sample_id, doc in stored.items()
+                if doc.get("properties_hash") != new_hashes[sample_id]
+            ]
+            existing_by_id = {}
+            if changed_ids:
+                existing_by_id = {
+                    doc["properties"]["ID"]: doc
+                    for doc in collection.find(
+                        {"properties.ID": {"$in": changed_ids}},
+                        {"properties": 1, "properties_hash": 1},
+                    )
+                }
+
+            operations = []
+            events = []
+
+            for item in batch:
+                sample_id = item["properties"]["ID"]
+                new_props = item.get("properties", {})
+
+                if sample_id in stored:
+                    existing = existing_by_id.get(sample_id)
+                    if existing is None:
+                        continue
+
+                    old_props = existing.get("properties", {})
+                    old_qc = old_props.get("QC_Status")
+                    new_qc = new_props.get("QC_Status")
+                    stored_props = old_props
+
+                    if old_qc != new_qc:
+                        stored_props = {**old_props, "QC_Status": new_qc}
+                        operations.append(
+                            UpdateOne(
+                                {"_id": existing["_id"]},
+                                {"$set": {"properties.QC_Status": new_qc}},
+                            )
+                        )
+                        events.append(
+                            dict(
+                                sample_id=sample_id,
+                                profile=new_props.get("analysis_profile"),
+                                changes_dict={
+                                    "QC_Status": {"old": old_qc, "new": new_qc}
+                                },
+                                changed_by="bonsai",
+                            )
+                        )
 
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
-    collection = db["similarities"]
+                    if overwrite:
+                        changed_fields = [
+                            f
+                            for f in get_changed_fields(existing, item)
+                            if f != "QC_Status"
+                        ]
+                        if changed_fields:
+                            stored_props = new_props
+                            operations.append(
+                                UpdateOne(
+                                    {"_id": existing["_id"]},
+                                    {"$set": {"properties": new_props}},
+                                )
+                            )
+                            updated_count += 1
+
+                            diff_dict = {}
+                            for field in changed_fields:
+                                if field == "ST":
+                                    old_val = old_props.get("typing", {}).get("ST")
+                                    new_val = new_props.get("typing", {}).get("ST")
+                                elif field in new_props.get("typing", {}).get(
+                                    "alleles", {}
+                                ):
+                                    old_val = (
+                                        old_props.get("typing", {})
+                                        .get("alleles", {})
+                                        .get(field)
+                                    )
+                                    new_val = (
+                                        new_props.get("typing", {})
+                                        .get("alleles", {})
+                                        .get(field)
+                                    )
+                                else:
+                                    old_val = old_props.get(field)
+                                    new_val = new_props.get(field)
+
+                                diff_dict[field] = {"old": old_val, "new": new_val}
+
+                            events.append(
+                                dict(
+                                    sample_id=sample_id,
+                                    profile=new_props.get("analysis_profile"),
+                                    changes_dict=diff_dict,
+                                    changed_by=uploader_email,
+                                )
+                            )
+
+                    # Keep the stored hash in line with the stored properties,
+                    # which also backfills documents written before hashing.
+                    stored_hash = properties_hash(stored_props)
+                    if existing.get("properties_hash") != stored_hash:
+                        operations.append(
+                            UpdateOne(
+                                {"_id": existing["_id"]},
+                                {"$set": {"properties_hash": stored_hash}},
+                            )
+                        )
+                else:
+                    item.setdefault("_id", ObjectId())
+                    item["properties_hash"] = new_hashes[sample_id]
+                    operations.append(InsertOne(item))
+                    stored[sample_id] = item
+                    existing_by_id[sample_id] = item
+                    uploaded_count += 1
+                    events.append(
+                        dict(
+                            sample_id=sample_id,
+                            profile=new_props.get("analysis_profile"),
+                            is_insert=True,
+                            changed_by=uploader_email,
+                        )
+                    )
 
-    try:
-        for item in similarity_data:
-            if "ID" not in item:
-                continue
-
-            collection.replace_one(
-                {"ID": item["ID"]},
-                item,
-                upsert=True,
+            if operations:
+                collection.bulk_write(operations, ordered=False)
+
+            for event in events:
+                log_buffer.add(**event)
+
+        try:
+            for batch in iter_batches(data_to_upload, FEATURE_BATCH_SIZE):
+                upload_batch(batch)
+        except Exception as err:
+            print("Error uploading data:", err)
+        finally:
+            try:
+                log_buffer.flush()
+            except Exception as err:
+                print("Error writing sample logs:", err)
+
+        if overwrite and show_log and updated_count == 0 and uploaded_count == 0:
+            print("No samples were updated or uploaded.")
+
+
+def upload_clustering(
+    data_file_path=None,
+    upload_token=None,
+    uploader=None,
+    retention=DEFAULT_CLUSTERING_RETENTION,
+    data=None,
+):
+    with uploader_scope(uploader, upload_token) as uploader:
+        try:
+            clustering_data = load_upload_data(data_file_path, data, read_clustering)
+        except Exception as error:
+            print("Error loading clustering data file:", error)
+            return
+
+        try:
+            summary = store_clustering(uploader.db, clustering_data, retention)
+            if summary["created"]:
+                print(
+                    f"Clustering version {summary['version']} stored "
+                    f"({summary['changed']} assignment(s) changed)"
+                )
+            else:
+                print(
+                    f"Clustering unchanged since version {summary['version']}, "
+                    "no new snapshot stored"
+                )
+            if summary["trimmed"]:
+                print(f"Removed {summary['trimmed']} old clustering snapshot(s)")
+        except Exception as err:
+            print("Error uploading clustering data:", err)
+
+
+def upload_distance(data_file_path=None, upload_token=None, uploader=None, data=None):
+    with uploader_scope(uploader, upload_token) as uploader:
+        try:
+            distance_data = load_upload_data(data_file_path, data, read_distance)
+        except Exception as error:
+            print("Error loading distance data file:", error)
+            return
+
+        profile = distance_data.get("analysis_profile")
+
+        try:
+            chunk_count = store_distance(
+                uploader.db,
+                profile,
+                distance_data.get("samples") or [],
+                distance_data.get("matrix", []),
+                distance_data.get("newick"),
+                created_at=distance_data.get("createdAt"),
             )
+            if chunk_count is None:
+                print(f"Distance data for {profile} is unchanged")
+            else:
+                print(f"Distance data stored for {profile} ({chunk_count} chunk(s))")
+        except Exception as err:
+            print("Error uploading distance data:", err)
+
+
+def update_neighbour_similarity(collection, neighbours, exclude_ids=()):
+    """
+    Add newly computed samples to the stored similar lists of existing samples
+    they now rank among. Only documents whose list changes are updated.
+    """
+    additions = invert_neighbours(neighbours, exclude_ids)
+    if not additions:
+        return 0
+
+    operations = []
+    neighbour_ids = list(additions)
+
+    for start in range(0, len(neighbour_ids), 1000):
+        chunk = neighbour_ids[start : start + 1000]
+        for doc in collection.find({"ID": {"$in": chunk}}, {"ID": 1, "similar": 1}):
+            # Compare in merge order, so stored ties in another order do not
+            # count as a change.
+            existing = sorted(doc.get("similar", []), key=similar_sort_key)
+            merged = merge_similar(existing, additions[doc["ID"]])
+            if merged != existing:
+                operations.append(
+                    UpdateOne({"_id": doc["_id"]}, {"$set": {"similar": merged}})
+                )
 
-            print(f"Similarity data for ID {item['ID']} uploaded successfully!")
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+
+    print(f"Similarity updated for {len(operations)} existing sample(s)")
+    return len(operations)
+
+
+def upload_similarity(
+    data_file_path=None, upload_token=None, uploader=None, neighbours=None, data=None
+):
+    """
+    Upload similarity results (data, or the JSON Lines or JSON array file at
+    data_file_path),
+    replacing existing documents by sample ID.
+    If neighbours ({sample_id: [similar entries]}) is given, the uploaded samples
+    are also merged into the similar lists of the existing samples they rank among.
+    """
+    with uploader_scope(uploader, upload_token) as uploader:
+        try:
+            similarity_data = load_upload_data(data_file_path, data, iter_documents)
+        except Exception as error:
+            print("Error loading similarity data file:", error)
+            return
+
+        collection = uploader.collection("similarities")
+
+        items = (item for item in similarity_data if "ID" in item)
+        uploaded_ids = set()
+        upserted_count = 0
+        modified_count = 0
+        matched_count = 0
+        failed = {}
+
+        try:
+            for batch in iter_batches(items, SIMILARITY_BATCH_SIZE):
+                uploaded_ids.update(item["ID"] for item in batch)
+                operations = [
+                    ReplaceOne({"ID": item["ID"]}, item, upsert=True) for item in batch
+                ]
+
+                try:
+                    result = collection.bulk_write(operations, ordered=False)
+                    upserted_count += result.upserted_count
+                    modified_count += result.modified_count
+                    matched_count += result.matched_count
+                except BulkWriteError as bwe:
+                    details = bwe.details
+                    upserted_count += details.get("nUpserted", 0)
+                    modified_count += details.get("nModified", 0)
+                    matched_count += details.get("nMatched", 0)
+                    for error in details.get("writeErrors", []):
+                        failed[batch[error["index"]]["ID"]] = error.get("errmsg")
+
+            print(
+                f"Similarity uploaded: {upserted_count} inserted, "
+                f"{modified_count} updated, {matched_count - modified_count} unchanged, "
+                f"{len(failed)} failed"
+            )
+            for sample_id, message in failed.items():
+                print(f"Error uploading similarity data for ID {sample_id}: {message}")
+
+            if neighbours:
+                update_neighbour_similarity(
+                    collection,
+                    neighbours,
+                    exclude_ids=uploaded_ids,
+                )
 
-    except Exception as err:
-        print("Error uploading similarity data:", err)
-    finally:
-        client.close()
+        except Exception as err:
+            print("Error uploading similarity data:", err)
@@ -66,10 +66,12 @@ def delete_test_data(test_data):
         print(f"Deleting entries for sample: {sample_id}")
         db["features"].delete_many({"properties.ID": sample_id})
         db["clustering"].delete_many({"ID": sample_id})
+        db["cluster_assignments"].delete_many({"ID": sample_id})
         db["similarities"].delete_many({"ID": sample_id})
 
     for profile in profiles:
         db["distance"].delete_many({"analysis_profile": profile})
+        db["distance_chunks"].delete_many({"analysis_profile": profile})
 
     print("Deletion completed.")
     client.close()